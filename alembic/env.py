@@ -4,7 +4,7 @@ from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 
 from alembic import context
-from app.database import Base
+from app.database import Base, get_database_url
 from app.models import Statistics
 from app.settings import get_db_settings
 
@@ -31,11 +31,7 @@ target_metadata = Base.metadata
 
 def get_url():
     """Returns sqlalchemy.url with variable from environment"""
-    db_settings = get_db_settings()
-    return (
-        f"{db_settings.engine}://{db_settings.user}:{db_settings.password}@"
-        f"{db_settings.host}:{db_settings.port}/{db_settings.database}"
-    )
+    return get_database_url(get_db_settings())
 
 
 def run_migrations_offline() -> None:
@@ -0,0 +1,101 @@
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Stops requests to the database after 'failure_threshold' consecutive
+    failures, so that requests fail fast instead of occupying worker threads
+    while the database is unavailable or overloaded. A query slower than
+    'latency_threshold' seconds counts as a failure.
+
+    After 'reset_timeout' seconds the circuit becomes half-open: one request
+    per 'reset_timeout' seconds is let through as a probe. Only the completed
+    probe request closes the circuit (queries of background tasks do not),
+    a failure opens it again. Thread-safe.
+    """
+
+    def __init__(
+        self, failure_threshold: int, latency_threshold: float, reset_timeout: float
+    ):
+        self.failure_threshold = failure_threshold
+        self.latency_threshold = latency_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._next_probe_at = .0
+        self._lock = threading.Lock()
+
+    def admit(self) -> str:
+        """Returns CLOSED if a request to the database may be made, HALF_OPEN if
+        the request may be made as the probe (its success has to be reported
+        with 'record_probe_success') or OPEN if the request is rejected.
+        """
+        if self.state == CLOSED:
+            return CLOSED
+        with self._lock:
+            # The circuit could have been closed while waiting for the lock
+            if self.state == CLOSED:
+                return CLOSED
+            now = time.monotonic()
+            if now >= self._next_probe_at:
+                self.state = HALF_OPEN
+                self._next_probe_at = now + self.reset_timeout
+                return HALF_OPEN
+            self.rejected += 1
+            return OPEN
+
+    def allow(self) -> bool:
+        """Returns True if a request to the database may be made."""
+        return self.admit() != OPEN
+
+    def retry_after(self) -> float:
+        """Returns the number of seconds until the next probe."""
+        return max(self._next_probe_at - time.monotonic(), 0)
+
+    def record_success(self, latency: float) -> None:
+        """Records a completed query and its latency (seconds). A successful
+        query resets consecutive failures of a closed circuit, but does not
+        close an open one.
+        """
+        if latency > self.latency_threshold:
+            self.record_failure()
+            return
+        if self.state != CLOSED or not self.failures:
+            return
+        with self._lock:
+            if self.state == CLOSED:
+                self.failures = 0
+
+    def record_probe_success(self) -> None:
+        """Closes the half-open circuit after the probe request has completed
+        (unless a query of the probe has opened the circuit again).
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.failures = 0
+                self.state = CLOSED
+
+    def record_failure(self) -> None:
+        """Records a failed (or too slow) query."""
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self.failures >= self.failure_threshold
+            ):
+                self.state = OPEN
+                self.opened += 1
+                self._next_probe_at = time.monotonic() + self.reset_timeout
+
+    def metrics(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
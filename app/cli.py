@@ -0,0 +1,142 @@
+"""Command line interface: python -m app.cli --help"""
+import argparse
+import datetime
+import sys
+
+from . import schemas
+from .crud import create_tenant_partition, get_tenants, refresh_statistics_totals
+from .database import create_session
+from .generator import generate_statistics
+from .importer import CHUNK_SIZE, FORMATS, detect_format, import_statistics, read_rows
+from .tenants import DEFAULT_TENANT
+
+
+def _print_report(report: schemas.ImportReport) -> None:
+    """Prints rejected rows and the import summary."""
+    for rejected_row in report.rejected:
+        print(f"Row {rejected_row.row} rejected: {rejected_row.error}", file=sys.stderr)
+    print(
+        f"Imported {report.imported} rows, rejected {report.rejected_count} rows "
+        f"in {report.seconds} s ({report.rows_per_second} rows/s)"
+    )
+
+
+def import_command(args: argparse.Namespace) -> None:
+    """Imports statistics from a CSV or Parquet file and prints the report."""
+    db = create_session()
+    try:
+        with open(args.path, "rb") as file:
+            rows = read_rows(file, args.format or detect_format(args.path))
+            report = import_statistics(
+                db, rows, chunk_size=args.chunk_size, tenant_id=args.tenant
+            )
+    finally:
+        db.close()
+    _print_report(report)
+
+
+def generate_command(args: argparse.Namespace) -> None:
+    """Loads synthetic daily statistics and prints the report."""
+    db = create_session()
+    try:
+        rows = generate_statistics(args.years, start=args.start, seed=args.seed)
+        report = import_statistics(
+            db, rows, chunk_size=args.chunk_size, tenant_id=args.tenant
+        )
+    finally:
+        db.close()
+    _print_report(report)
+
+
+def rebuild_totals_command(args: argparse.Namespace) -> None:
+    """Recomputes the prefix sums of statistics of all tenants."""
+    db = create_session()
+    try:
+        for tenant_id in get_tenants(db):
+            refresh_statistics_totals(db, tenant_id=tenant_id)
+        db.commit()
+    finally:
+        db.close()
+    print("Rebuilt prefix sums of statistics")
+
+
+def create_partition_command(args: argparse.Namespace) -> None:
+    """Moves statistics of the tenant to a partition of its own (PostgreSQL)."""
+    db = create_session()
+    try:
+        created = create_tenant_partition(db, args.tenant)
+        db.commit()
+    except ValueError as error:
+        sys.exit(str(error))
+    finally:
+        db.close()
+    if created:
+        print(f"Created the partition of the tenant '{args.tenant}'")
+    else:
+        print(f"The tenant '{args.tenant}' already has a partition")
+
+
+def main(argv: list[str] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.cli", description="Statistics counter service commands."
+    )
+    subparsers = parser.add_subparsers(required=True)
+
+    import_parser = subparsers.add_parser(
+        "import", help="import statistics from a CSV or Parquet file"
+    )
+    import_parser.add_argument("path", help="path to the file")
+    import_parser.add_argument(
+        "--format", choices=FORMATS, help="file format (by default by the extension)"
+    )
+    import_parser.add_argument(
+        "--chunk-size", type=int, default=CHUNK_SIZE,
+        help=f"number of rows validated and loaded at a time (default {CHUNK_SIZE})"
+    )
+    import_parser.add_argument(
+        "--tenant", default=DEFAULT_TENANT,
+        help=f"tenant of the statistics (default '{DEFAULT_TENANT}')"
+    )
+    import_parser.set_defaults(handler=import_command)
+
+    generate_parser = subparsers.add_parser(
+        "generate", help="load synthetic daily statistics (for development and tests)"
+    )
+    generate_parser.add_argument(
+        "--years", type=float, default=1, help="number of years (default 1)"
+    )
+    generate_parser.add_argument(
+        "--start", type=datetime.date.fromisoformat, default=datetime.date(2000, 1, 1),
+        help="first date in the format YYYY-MM-DD (default 2000-01-01)"
+    )
+    generate_parser.add_argument(
+        "--seed", type=int, help="seed of the random generator"
+    )
+    generate_parser.add_argument(
+        "--chunk-size", type=int, default=CHUNK_SIZE,
+        help=f"number of rows loaded at a time (default {CHUNK_SIZE})"
+    )
+    generate_parser.add_argument(
+        "--tenant", default=DEFAULT_TENANT,
+        help=f"tenant of the statistics (default '{DEFAULT_TENANT}')"
+    )
+    generate_parser.set_defaults(handler=generate_command)
+
+    rebuild_totals_parser = subparsers.add_parser(
+        "rebuild-totals", help="recompute prefix sums of statistics (TOTALS_ENABLED)"
+    )
+    rebuild_totals_parser.set_defaults(handler=rebuild_totals_command)
+
+    create_partition_parser = subparsers.add_parser(
+        "create-partition",
+        help="move statistics of a tenant to a partition of its own (PostgreSQL)"
+    )
+    create_partition_parser.add_argument("tenant", help="tenant id")
+    create_partition_parser.set_defaults(handler=create_partition_command)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
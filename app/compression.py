@@ -0,0 +1,116 @@
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipResponder
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .settings import CompressionSettings, get_compression_settings
+
+try:
+    import brotli
+except ImportError:  # Brotli compression is optional
+    brotli = None
+
+
+def get_accepted_encodings(accept_encoding: str) -> set[str]:
+    """Returns the encodings of the 'Accept-Encoding' header except
+    the ones explicitly refused with 'q=0'.
+    """
+    encodings = set()
+    for item in accept_encoding.split(","):
+        encoding, *parameters = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    pass
+        if encoding and quality > 0:
+            encodings.add(encoding.lower())
+    return encodings
+
+
+class CompressionMiddleware:
+    """Compresses responses of at least 'minimum_size' bytes with brotli if
+    the client accepts it and the package 'brotli' is installed, or with gzip.
+    The configuration is read on the first request.
+    """
+
+    def __init__(self, app: ASGIApp, settings: CompressionSettings = None) -> None:
+        self.app = app
+        self.settings = settings
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            self.settings = self.settings or get_compression_settings()
+            accepted = get_accepted_encodings(
+                Headers(scope=scope).get("Accept-Encoding", "")
+            )
+            if brotli is not None and "br" in accepted:
+                responder = BrotliResponder(
+                    self.app, self.settings.minimum_size, self.settings.brotli_quality
+                )
+                await responder(scope, receive, send)
+                return
+            if "gzip" in accepted:
+                responder = GZipResponder(
+                    self.app, self.settings.minimum_size,
+                    compresslevel=self.settings.gzip_level
+                )
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class BrotliResponder:
+    """Sends the response compressed with brotli (see GZipResponder)."""
+
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compressor = brotli.Compressor(quality=quality)
+        self.send = None
+        self.initial_message = {}
+        self.started = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_with_brotli)
+
+    def _compress(self, body: bytes, more_body: bool) -> bytes:
+        compressed = self.compressor.process(body)
+        if not more_body:
+            compressed += self.compressor.finish()
+        return compressed
+
+    async def send_with_brotli(self, message: Message) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            # The initial message is sent when the size of the body is known
+            self.initial_message = message
+        elif message_type == "http.response.body" and not self.started:
+            self.started = True
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if len(body) < self.minimum_size and not more_body:
+                # Small responses are not compressed
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+
+            headers = MutableHeaders(raw=self.initial_message["headers"])
+            headers["Content-Encoding"] = "br"
+            headers.add_vary_header("Accept-Encoding")
+            message["body"] = self._compress(body, more_body)
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(message["body"]))
+
+            await self.send(self.initial_message)
+            await self.send(message)
+        elif message_type == "http.response.body":
+            message["body"] = self._compress(
+                message.get("body", b""), message.get("more_body", False)
+            )
+            await self.send(message)
@@ -1,26 +1,54 @@
-from datetime import date
+from datetime import date, datetime
 from typing import Optional
 
-from sqlalchemy import and_
+from sqlalchemy import (
+    Float,
+    Integer,
+    and_,
+    cast,
+    func,
+    insert,
+    literal,
+    select,
+    text
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from . import models, schemas
-from .exceptions import UniqueViolationException
+from .exceptions import DuplicateEventException, UniqueViolationException
+from .live import track_changes, track_resync
+from .services import percentile_cont
+from .settings import TENANT_ID_PATTERN, get_totals_settings
+from .tenants import DEFAULT_TENANT
+
+# Fields and derived metrics by which statistics can be ranked
+SORTABLE_FIELDS = ("views", "clicks", "cost", "cpc", "cpm")
+PERCENTILE_METRICS = SORTABLE_FIELDS
+# Summed fields of statistics
+TOTAL_FIELDS = ("views", "clicks", "cost")
+# Key of the PostgreSQL advisory lock that serializes updates of prefix sums
+TOTALS_LOCK_KEY = 7_537_843
+# Prefix of names of partitions of statistics by tenant (PostgreSQL)
+TENANT_PARTITION_PREFIX = "statistic_tenant_"
 
 
 def get_statistics_for_date(
-    db: Session, statistics_date: date
+    db: Session, statistics_date: date, tenant_id: str = DEFAULT_TENANT
 ) -> Optional[models.Statistics]:
-    """Returns all statistics for a specific date or returns None
+    """Returns all statistics of the tenant for a specific date or returns None
     if there are no statistics in the database for the specific date.
     """
     return db.query(models.Statistics).filter(
-        models.Statistics.date == statistics_date
+        models.Statistics.tenant_id == tenant_id,
+        models.Statistics.date == statistics_date,
     ).first()
 
 
 def get_statistics_for_date_period(
     db: Session, date_from: date = None, date_to: date = None,
+    tenant_id: str = DEFAULT_TENANT,
 ) -> list[models.Statistics]:
     """Returns all statistics for a certain date period.
     Parameters 'date_from' and 'date_to' are included in the selection.
@@ -34,29 +62,278 @@ def get_statistics_for_date_period(
     - If only 'date_to' is entered, then all statistics up to
       'date_to' (inclusive) are returned
     - If both parameters 'date_from' and 'date_to' are omitted then
-      all available statistics in the database are returned
+      all available statistics of the tenant in the database are returned
+    """
+    return db.query(models.Statistics).filter(
+        _date_period_condition(tenant_id, date_from, date_to)
+    ).all()
+
+
+def _date_period_condition(
+    tenant_id: str, date_from: date = None, date_to: date = None
+):
+    """Returns the condition of the selection of statistics of the tenant
+    for the date period.
     """
     # Defining a list of conditions for statistics search
-    search_expressions = []
+    search_expressions = [models.Statistics.tenant_id == tenant_id]
     if date_from:
         search_expressions.append(models.Statistics.date >= date_from)
     if date_to:
         search_expressions.append(models.Statistics.date <= date_to)
+    return and_(*search_expressions)
+
+
+def _metric_expression(metric: str):
+    """Returns the SQL expression of a field or a derived metric of statistics.
+    Derived metrics are NULL for days without clicks (cpc) or views (cpm).
+    """
+    if metric == "cpc":
+        return models.Statistics.cost / func.nullif(models.Statistics.clicks, 0)
+    if metric == "cpm":
+        return models.Statistics.cost * 1000 / func.nullif(models.Statistics.views, 0)
+    return getattr(models.Statistics, metric)
+
+
+def get_top_statistics(
+    db: Session, sort_by: str, limit: int, ascending: bool = False,
+    date_from: date = None, date_to: date = None, tenant_id: str = DEFAULT_TENANT,
+) -> list[models.Statistics]:
+    """Returns 'limit' statistics of the date period with the largest
+    (or the smallest if 'ascending') values of the field 'sort_by'
+    (one of SORTABLE_FIELDS). Days where a derived metric is not defined
+    are not included. The selection is made by the database (ORDER BY ... LIMIT).
+    """
+    expression = _metric_expression(sort_by)
+    return db.query(models.Statistics).filter(
+        _date_period_condition(tenant_id, date_from, date_to),
+        expression.isnot(None),
+    ).order_by(
+        expression.asc() if ascending else expression.desc(),
+        models.Statistics.date,
+    ).limit(limit).all()
+
+
+def get_statistics_percentiles(
+    db: Session, percentiles: list[float],
+    date_from: date = None, date_to: date = None, tenant_id: str = DEFAULT_TENANT,
+) -> dict[str, list[Optional[float]]]:
+    """Returns percentiles (from 0 to 1, with linear interpolation) of each metric
+    of statistics for the date period in the form {metric: [values]}.
+    Days where a derived metric is not defined are not taken into account.
+
+    PostgreSQL computes percentiles with percentile_cont, for other databases
+    only the metric columns are selected and percentiles are computed in-process.
+    """
+    condition = _date_period_condition(tenant_id, date_from, date_to)
+
+    if db.get_bind().dialect.name == "postgresql":
+        row = db.query(*[
+            func.percentile_cont(
+                postgresql.array(percentiles), type_=postgresql.ARRAY(Float)
+            ).within_group(_metric_expression(metric))
+            for metric in PERCENTILE_METRICS
+        ]).filter(condition).one()
+        return {
+            metric: list(values) if values else [None] * len(percentiles)
+            for metric, values in zip(PERCENTILE_METRICS, row)
+        }
+
+    rows = db.query(*[
+        _metric_expression(metric) for metric in PERCENTILE_METRICS
+    ]).filter(condition).all()
+    result = dict()
+    for metric, values in zip(PERCENTILE_METRICS, zip(*rows) if rows else []):
+        values = sorted(value for value in values if value is not None)
+        result[metric] = [percentile_cont(values, q) for q in percentiles]
+    for metric in PERCENTILE_METRICS:
+        result.setdefault(metric, [None] * len(percentiles))
+    return result
+
+
+def _day_number(db: Session):
+    """Returns the SQL expression of the number of the day of statistics,
+    by which moving windows of days are ordered.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return models.Statistics.date - literal(date(1970, 1, 1))
+    return cast(func.julianday(models.Statistics.date), Integer)
+
 
-    return db.query(models.Statistics).filter(and_(True, *search_expressions)).all()
+def get_running_statistics(
+    db: Session, windows: list[int], date_from: date = None, date_to: date = None,
+    tenant_id: str = DEFAULT_TENANT,
+) -> list:
+    """Returns statistics for the date period with cumulative sums of the fields
+    since the first statistics (columns 'cumulative_<field>') and sums of the fields
+    over moving windows of 'windows' days ending on each date (columns
+    'moving_<window>_<field>'), ordered by date. Days without statistics
+    count as zeros in the windows.
 
+    Sums are computed with window functions over all statistics up to 'date_to',
+    the result is limited by 'date_from' outside of the window computation,
+    so that the sums include statistics preceding the period.
+    """
+    day_number = _day_number(db)
+    columns = [models.Statistics.date]
+    for field in TOTAL_FIELDS:
+        column = getattr(models.Statistics, field)
+        columns.append(column)
+        columns.append(func.sum(column).over(
+            order_by=models.Statistics.date
+        ).label(f"cumulative_{field}"))
+        for window in windows:
+            columns.append(func.sum(column).over(
+                order_by=day_number, range_=(-(window - 1), 0)
+            ).label(f"moving_{window}_{field}"))
+
+    running = db.query(*columns).filter(
+        _date_period_condition(tenant_id, date_to=date_to)
+    ).subquery()
+    query = db.query(running)
+    if date_from:
+        query = query.filter(running.c.date >= date_from)
+    return query.order_by(running.c.date).all()
+
+
+def get_statistics_total(
+    db: Session, date_from: date = None, date_to: date = None,
+    tenant_id: str = DEFAULT_TENANT,
+) -> tuple[int, int, float]:
+    """Returns the total views, clicks and cost of the tenant for the date period.
 
-def create_statistics(db: Session, statistics: schemas.Statistics) -> models.Statistics:
-    """Creates an instance of statistics in the database if there were no
-    statistics for this date or raises an exception UniqueViolationException.
+    If prefix sums are maintained, the total is the difference of the prefix
+    sum up to 'date_to' and the prefix sum before 'date_from' (two index
+    lookups regardless of the length of the period), otherwise the statistics
+    of the period are summed up.
+    """
+    if get_totals_settings().enabled:
+        if date_from and date_to and date_from > date_to:
+            # An empty period (its prefix sums would give a negative total)
+            return 0, 0, .0
+        upper = _get_prefix_sum(db, tenant_id, until=date_to)
+        lower = (
+            _get_prefix_sum(db, tenant_id, before=date_from) if date_from
+            else (0, 0, .0)
+        )
+        return tuple(total - preceding for total, preceding in zip(upper, lower))
+
+    return tuple(db.query(*[
+        func.coalesce(func.sum(getattr(models.Statistics, field)), 0)
+        for field in TOTAL_FIELDS
+    ]).filter(_date_period_condition(tenant_id, date_from, date_to)).one())
+
+
+def _get_prefix_sum(
+    db: Session, tenant_id: str, before: date = None, until: date = None
+) -> tuple[int, int, float]:
+    """Returns the prefix sum of the tenant of the last date before 'before' or
+    up to 'until' (inclusive) or zeros if there are no statistics up to this date.
+    """
+    totals = models.StatisticsTotal
+    query = db.query(totals.views, totals.clicks, totals.cost).filter(
+        totals.tenant_id == tenant_id
+    )
+    if before:
+        query = query.filter(totals.date < before)
+    if until:
+        query = query.filter(totals.date <= until)
+    prefix_sum = query.order_by(totals.date.desc()).first()
+    return tuple(prefix_sum) if prefix_sum is not None else (0, 0, .0)
+
+
+def _lock_totals(db: Session, tenant_id: str) -> None:
+    """Serializes updates of prefix sums of the tenant until the end of
+    the transaction (PostgreSQL), since a new prefix sum is derived from
+    the preceding one.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(func.pg_advisory_xact_lock(
+            TOTALS_LOCK_KEY, func.hashtext(tenant_id)
+        ).select())
+
+
+def add_to_statistics_totals(
+    db: Session, statistics_date: date, views: int, clicks: int, cost: float,
+    tenant_id: str = DEFAULT_TENANT,
+) -> None:
+    """Adds values of statistics of the date to the prefix sums of the tenant of
+    the date and all following dates if prefix sums are maintained.
+    The transaction is not committed.
+    """
+    if not get_totals_settings().enabled:
+        return
+    _lock_totals(db, tenant_id)
+    totals = models.StatisticsTotal
+    tenant_totals = db.query(totals).filter(totals.tenant_id == tenant_id)
+    if tenant_totals.filter(totals.date == statistics_date).first() is None:
+        preceding = _get_prefix_sum(db, tenant_id, before=statistics_date)
+        db.execute(insert(totals).values(dict(
+            zip(("tenant_id", "date", *TOTAL_FIELDS),
+                (tenant_id, statistics_date, *preceding))
+        )))
+    tenant_totals.filter(totals.date >= statistics_date).update({
+        totals.views: totals.views + views,
+        totals.clicks: totals.clicks + clicks,
+        totals.cost: totals.cost + cost,
+    }, synchronize_session=False)
+
+
+def refresh_statistics_totals(
+    db: Session, since: date = None, tenant_id: str = DEFAULT_TENANT
+) -> None:
+    """Recomputes the prefix sums of the tenant of all dates starting from
+    'since' (or of all dates) from the statistics, for example after bulk
+    changes of statistics. The transaction is not committed.
+    """
+    _lock_totals(db, tenant_id)
+    totals = models.StatisticsTotal
+    preceding = (
+        _get_prefix_sum(db, tenant_id, before=since) if since else (0, 0, .0)
+    )
+    outdated = db.query(totals).filter(totals.tenant_id == tenant_id)
+    if since:
+        outdated = outdated.filter(totals.date >= since)
+    outdated.delete(synchronize_session=False)
+    db.execute(insert(totals).from_select(
+        ["tenant_id", "date", *TOTAL_FIELDS],
+        select(models.Statistics.tenant_id, models.Statistics.date, *[
+            func.sum(getattr(models.Statistics, field)).over(
+                order_by=models.Statistics.date
+            ) + initial
+            for field, initial in zip(TOTAL_FIELDS, preceding)
+        ]).where(_date_period_condition(tenant_id, date_from=since)),
+    ))
+
+
+def get_tenants(db: Session) -> list[str]:
+    """Returns the tenants that have statistics."""
+    return [
+        tenant_id for tenant_id, in db.query(models.Statistics.tenant_id).distinct()
+    ]
+
+
+def create_statistics(
+    db: Session, statistics: schemas.Statistics, tenant_id: str = DEFAULT_TENANT
+) -> models.Statistics:
+    """Creates an instance of statistics of the tenant in the database if there
+    were no statistics for this date or raises an exception UniqueViolationException.
     """
     # If an object with the same date is already in the database,
     # then raise an exception
-    if get_statistics_for_date(db, statistics.date):
+    if get_statistics_for_date(db, statistics.date, tenant_id):
         raise UniqueViolationException
 
-    new_statistics = models.Statistics(**statistics.dict())
+    new_statistics = models.Statistics(
+        tenant_id=tenant_id, **statistics.dict(exclude={"idempotency_key"})
+    )
     db.add(new_statistics)
+    add_to_statistics_totals(
+        db, new_statistics.date,
+        new_statistics.views, new_statistics.clicks, new_statistics.cost,
+        tenant_id,
+    )
+    track_changes(db, [new_statistics.date], tenant_id)
     db.commit()
     db.refresh(new_statistics)
 
@@ -65,31 +342,60 @@ def create_statistics(db: Session, statistics: schemas.Statistics) -> models.Sta
 
 def summarize_statistics(
     db: Session, statistics: models.Statistics,
-    views: int = 0, clicks: int = 0, cost: float = .0
+    views: int = 0, clicks: int = 0, cost: float = .0,
+    tenant_id: str = DEFAULT_TENANT,
 ) -> models.Statistics:
-    """Adds values to statistics and returns an updated object."""
+    """Adds values to statistics of the tenant and returns an updated object."""
     statistics.views += views
     statistics.clicks += clicks
     statistics.cost += cost
+    add_to_statistics_totals(db, statistics.date, views, clicks, cost, tenant_id)
+    track_changes(db, [statistics.date], tenant_id)
     db.commit()
 
     return statistics
 
 
 def summarize_or_create_statistics(
-    db: Session, statistics: schemas.Statistics
+    db: Session, statistics: schemas.Statistics, idempotency_key: str = None,
+    tenant_id: str = DEFAULT_TENANT,
 ) -> tuple[models.Statistics, bool]:
-    """Adds statistics data to the database if there are no statistics for the
-    input date in the database or adds indicators to the available values.
+    """Adds statistics data of the tenant to the database if there are no
+    statistics for the input date in the database or adds indicators to
+    the available values.
     Returns the statistics object and the value True if the object was created
     and the value False if the object was already in the database.
+
+    If 'idempotency_key' is entered, it is saved in the same transaction as
+    the statistics, and a repeated event with the same key raises
+    an exception DuplicateEventException instead of being summarized again.
     """
+    if idempotency_key is None:
+        return _summarize_or_create_statistics(db, statistics, tenant_id)
+
+    if is_idempotency_key_used(db, idempotency_key, tenant_id):
+        raise DuplicateEventException
+    db.add(models.IdempotencyKey(tenant_id=tenant_id, key=idempotency_key))
+
+    try:
+        return _summarize_or_create_statistics(db, statistics, tenant_id)
+    except IntegrityError:
+        # A concurrent request with the same key has been committed first
+        db.rollback()
+        if is_idempotency_key_used(db, idempotency_key, tenant_id):
+            raise DuplicateEventException
+        raise
 
-    received_statistics = get_statistics_for_date(db, statistics.date)
+
+def _summarize_or_create_statistics(
+    db: Session, statistics: schemas.Statistics, tenant_id: str
+) -> tuple[models.Statistics, bool]:
+    """Summarizes or creates statistics, see summarize_or_create_statistics."""
+    received_statistics = get_statistics_for_date(db, statistics.date, tenant_id)
 
     # If there are no statistics for this date in the database, create a new object
     if not received_statistics:
-        created_statistics = create_statistics(db, statistics)
+        created_statistics = create_statistics(db, statistics, tenant_id)
         return created_statistics, True
 
     # If there are statistics for this date, summarize values
@@ -97,13 +403,204 @@ def summarize_or_create_statistics(
         db, received_statistics,
         views=statistics.views,
         clicks=statistics.clicks,
-        cost=statistics.cost
+        cost=statistics.cost,
+        tenant_id=tenant_id,
     )
 
     return updated_statistics, False
 
 
-def delete_all_statistics(db: Session) -> None:
-    """Clears all statistics from the database."""
-    db.query(models.Statistics).delete()
+def tenant_partition_name(tenant_id: str) -> str:
+    """Returns the name of the partition of statistics of the tenant.
+    Tenant ids consist of lowercase letters, digits and underscores,
+    so the name is a valid identifier.
+    """
+    return TENANT_PARTITION_PREFIX + tenant_id
+
+
+def _get_tenant_partition(db: Session, tenant_id: str) -> Optional[str]:
+    """Returns the name of the partition of statistics of the tenant or None
+    if the tenant has no partition of its own.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return None
+    name = tenant_partition_name(tenant_id)
+    return name if db.scalar(select(func.to_regclass(name))) else None
+
+
+def create_tenant_partition(db: Session, tenant_id: str) -> bool:
+    """Moves statistics of the tenant to a partition of its own, so that they
+    are stored apart from other tenants and can be cleared without scanning
+    the shared table. Returns False if the tenant already has a partition.
+
+    Requires PostgreSQL with the table of statistics partitioned by tenant
+    (see the migration of tenants) and a valid tenant id, otherwise
+    raises ValueError.
+    The transaction is not committed.
+    """
+    if not TENANT_ID_PATTERN.match(tenant_id):
+        raise ValueError(f"Invalid tenant id: {tenant_id}")
+    if db.get_bind().dialect.name != "postgresql" or db.scalar(text(
+        "SELECT relkind FROM pg_class WHERE oid = 'statistic'::regclass"
+    )) != "p":
+        raise ValueError("The table of statistics is not partitioned by tenant")
+    if _get_tenant_partition(db, tenant_id):
+        return False
+
+    name = tenant_partition_name(tenant_id)
+    db.execute(text(
+        f"CREATE TABLE {name} "
+        f"(LIKE statistic INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    ))
+    # Rows of the tenant are moved out of the default partition first, otherwise
+    # the partition can not be attached
+    db.execute(text(
+        f"WITH moved AS (DELETE FROM statistic WHERE tenant_id = :tenant_id "
+        f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+    ), {"tenant_id": tenant_id})
+    db.execute(text(
+        f"ALTER TABLE statistic ATTACH PARTITION {name} "
+        f"FOR VALUES IN ('{tenant_id}')"
+    ))
+    return True
+
+
+def delete_all_statistics(db: Session, tenant_id: str = DEFAULT_TENANT) -> None:
+    """Clears all statistics of the tenant (and their prefix sums) from the
+    database. If the tenant has a partition of its own, the partition is
+    truncated instead of deleting rows from the shared table.
+    """
+    partition = _get_tenant_partition(db, tenant_id)
+    if partition:
+        db.execute(text(f"TRUNCATE {partition}"))
+    else:
+        db.query(models.Statistics).filter(
+            models.Statistics.tenant_id == tenant_id
+        ).delete(synchronize_session=False)
+    db.query(models.StatisticsTotal).filter(
+        models.StatisticsTotal.tenant_id == tenant_id
+    ).delete(synchronize_session=False)
+    track_resync(db, tenant_id)
     db.commit()
+
+
+def is_idempotency_key_used(
+    db: Session, idempotency_key: str, tenant_id: str = DEFAULT_TENANT
+) -> bool:
+    """Returns True if an event of the tenant with this idempotency key
+    has already been applied.
+    """
+    return db.get(models.IdempotencyKey, (tenant_id, idempotency_key)) is not None
+
+
+def delete_expired_idempotency_keys(
+    db: Session, expired_before: datetime, max_keys: int = None
+) -> int:
+    """Deletes in bulk all idempotency keys created before 'expired_before'.
+    If 'max_keys' is entered, the oldest keys above this limit are deleted too.
+    Returns the number of deleted keys.
+    """
+    deleted = db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.created_at < expired_before
+    ).delete(synchronize_session=False)
+
+    if max_keys is not None:
+        # The creation time of the newest key that does not fit into the limit
+        boundary = db.query(models.IdempotencyKey.created_at).order_by(
+            models.IdempotencyKey.created_at.desc()
+        ).offset(max_keys).limit(1).scalar()
+        if boundary is not None:
+            deleted += db.query(models.IdempotencyKey).filter(
+                models.IdempotencyKey.created_at <= boundary
+            ).delete(synchronize_session=False)
+
+    db.commit()
+    return deleted
+
+
+def summarize_statistics_batch(
+    db: Session, events: list[schemas.StatisticsEvent],
+    tenant_id: str = DEFAULT_TENANT,
+) -> int:
+    """Aggregates events by date and adds them to the statistics of the tenant
+    in the database.
+    Events with already used (or repeated in the batch) idempotency keys are skipped.
+    Returns the number of applied events.
+
+    The transaction is not committed, so that the caller can save
+    additional data (for example, a checkpoint) atomically with the statistics.
+    """
+    keys = {event.idempotency_key for event in events if event.idempotency_key}
+    used_keys = set()
+    if keys:
+        used_keys = {
+            key for key, in db.query(models.IdempotencyKey.key).filter(
+                models.IdempotencyKey.tenant_id == tenant_id,
+                models.IdempotencyKey.key.in_(keys),
+            )
+        }
+
+    # Summing up events of the batch by date
+    aggregated = dict()
+    applied = 0
+    for event in events:
+        if event.idempotency_key:
+            if event.idempotency_key in used_keys:
+                continue
+            used_keys.add(event.idempotency_key)
+            db.add(models.IdempotencyKey(
+                tenant_id=tenant_id, key=event.idempotency_key
+            ))
+        views, clicks, cost = aggregated.get(event.date, (0, 0, .0))
+        aggregated[event.date] = (
+            views + event.views, clicks + event.clicks, cost + event.cost
+        )
+        applied += 1
+
+    if not aggregated:
+        return applied
+
+    existing = {
+        statistics.date: statistics
+        for statistics in db.query(models.Statistics).filter(
+            models.Statistics.tenant_id == tenant_id,
+            models.Statistics.date.in_(aggregated),
+        )
+    }
+    for statistics_date, (views, clicks, cost) in aggregated.items():
+        statistics = existing.get(statistics_date)
+        if statistics is None:
+            db.add(models.Statistics(
+                tenant_id=tenant_id, date=statistics_date,
+                views=views, clicks=clicks, cost=round(cost, 2)
+            ))
+        else:
+            statistics.views += views
+            statistics.clicks += clicks
+            statistics.cost += cost
+    for statistics_date in sorted(aggregated):
+        add_to_statistics_totals(
+            db, statistics_date, *aggregated[statistics_date], tenant_id
+        )
+    track_changes(db, aggregated, tenant_id)
+
+    return applied
+
+
+def get_ingest_checkpoint(
+    db: Session, log: str
+) -> Optional[models.IngestCheckpoint]:
+    """Returns the checkpoint of the ingest log or None if the log
+    has never been applied.
+    """
+    return db.get(models.IngestCheckpoint, log)
+
+
+def save_ingest_checkpoint(db: Session, log: str, segment: int, offset: int) -> None:
+    """Saves the checkpoint of the ingest log. The transaction is not committed."""
+    checkpoint = get_ingest_checkpoint(db, log)
+    if checkpoint is None:
+        db.add(models.IngestCheckpoint(log=log, segment=segment, offset=offset))
+        return
+    checkpoint.segment = segment
+    checkpoint.offset = offset
@@ -1,24 +1,256 @@
-from sqlalchemy import create_engine
+import math
+import time
+from typing import Callable, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session, sessionmaker
-from .settings import get_db_settings
 
-db_settings = get_db_settings()
-SQLALCHEMY_DATABASE_URL = (
-    f"{db_settings.engine}://{db_settings.user}:{db_settings.password}@"
-    f"{db_settings.host}:{db_settings.port}/{db_settings.database}"
-)
+from .breaker import HALF_OPEN, OPEN, CircuitBreaker
+from .exceptions import DatabaseUnavailableException
+from .metrics import register_metrics, unregister_metrics
+from .replicas import ReplicaRouter
+from .settings import DatabaseSettings, get_db_settings, get_health_settings
+
+# Requests with this cookie or header read from the primary (read-your-writes)
+READ_PRIMARY_COOKIE = "read_primary"
+READ_PRIMARY_HEADER = "X-Read-Your-Writes"
+# SQLSTATE of a query canceled by 'statement_timeout' (PostgreSQL)
+QUERY_CANCELED = "57014"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# The engine is created lazily in each worker process after fork (see init_engine),
+# so that importing the package does not require the database configuration
+# and the processes do not share connections of the pool
+engine: Optional[Engine] = None
+# Read replicas of the current process (None if they are not configured)
+replicas: Optional[ReplicaRouter] = None
+# Circuit breaker of the primary of the current process
+breaker: Optional[CircuitBreaker] = None
+# Event listeners that report queries of the engine to the circuit breaker
+_engine_listeners: list[tuple[str, Callable]] = []
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
 Base = declarative_base()
 
 
+def get_database_url(db_settings: DatabaseSettings) -> str:
+    """Returns the database URL made from the database configuration."""
+    return (
+        f"{db_settings.engine}://{db_settings.user}:{db_settings.password}@"
+        f"{db_settings.host}:{db_settings.port}/{db_settings.database}"
+    )
+
+
+def _create_engine(url: str, db_settings: DatabaseSettings) -> Engine:
+    return create_engine(
+        url,
+        pool_size=db_settings.pool_size,
+        max_overflow=db_settings.max_overflow,
+        pool_timeout=db_settings.pool_timeout,
+        pool_recycle=db_settings.pool_recycle,
+        pool_pre_ping=True,
+    )
+
+
+def init_engine(db_settings: DatabaseSettings = None) -> Engine:
+    """Creates the engines of the primary and of the read replicas of
+    the current process and binds sessions to the primary.
+    """
+    global replicas
+    db_settings = db_settings or get_db_settings()
+    if db_settings.replica_urls:
+        replicas = ReplicaRouter(
+            [_create_engine(url, db_settings) for url in db_settings.replica_urls],
+            max_lag=db_settings.replica_max_lag,
+            check_interval=db_settings.replica_check_interval,
+            retry_interval=db_settings.replica_retry_interval,
+        )
+        register_metrics("replicas", replicas.metrics)
+    return use_engine(_create_engine(get_database_url(db_settings), db_settings))
+
+
+def use_engine(new_engine: Engine) -> Engine:
+    """Makes the engine the engine of the current process and binds sessions to it
+    (for example, to use a test database).
+    """
+    global engine, breaker
+    if engine is not None:
+        _unwatch_engine()
+    engine = new_engine
+    SessionLocal.configure(bind=engine)
+
+    settings = get_health_settings()
+    breaker = CircuitBreaker(
+        settings.failure_threshold, settings.slow_query, settings.reset_timeout
+    )
+    _watch_engine(engine, breaker)
+    register_metrics("circuit_breaker", breaker.metrics)
+    return engine
+
+
+def _is_database_failure(context) -> bool:
+    """Returns True if the error means that the database is unavailable or
+    overloaded: a lost connection, a failure to connect or a query timeout.
+    Errors of statements (for example, a missing table or a constraint
+    violation) are not failures of the database.
+    """
+    if context.is_disconnect:
+        return True
+    # Errors of establishing a connection have no connection
+    if context.connection is None:
+        return True
+    return getattr(context.original_exception, "pgcode", None) == QUERY_CANCELED
+
+
+def _watch_engine(watched_engine: Engine, circuit_breaker: CircuitBreaker) -> None:
+    """Reports the latency of queries of the engine and failures of connections
+    to the circuit breaker. The listeners are removed by _unwatch_engine.
+    """
+    def start_query(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def finish_query(connection, cursor, statement, parameters, context, executemany):
+        started = connection.info["query_started"].pop()
+        circuit_breaker.record_success(time.perf_counter() - started)
+
+    def fail_query(context):
+        if context.connection is not None:
+            started = context.connection.info.get("query_started")
+            if started:
+                started.pop()
+        if _is_database_failure(context):
+            circuit_breaker.record_failure()
+
+    _engine_listeners[:] = [
+        ("before_cursor_execute", start_query),
+        ("after_cursor_execute", finish_query),
+        ("handle_error", fail_query),
+    ]
+    for name, listener in _engine_listeners:
+        event.listen(watched_engine, name, listener)
+
+
+def _unwatch_engine() -> None:
+    """Removes the listeners of the engine of the current process."""
+    for name, listener in _engine_listeners:
+        event.remove(engine, name, listener)
+    _engine_listeners.clear()
+
+
+def get_engine() -> Engine:
+    """Returns the engine of the current process, creating it on first use."""
+    if engine is None:
+        init_engine()
+    return engine
+
+
+def create_session(bind: Engine = None) -> Session:
+    """Returns a new session bound to the engine of the current process
+    or to the entered engine.
+    """
+    get_engine()
+    return SessionLocal(bind=bind) if bind is not None else SessionLocal()
+
+
+def warm_pool(size: int) -> None:
+    """Opens 'size' connections of the pool in advance, so that the first
+    requests do not wait for connections to be established.
+    """
+    connections = [get_engine().connect() for _ in range(size)]
+    for connection in connections:
+        connection.close()
+
+
+def dispose_engine() -> None:
+    """Closes all connections of the pools of the current process."""
+    global engine, replicas, breaker
+    if engine is not None:
+        unregister_metrics("circuit_breaker")
+        _unwatch_engine()
+        engine.dispose()
+        engine = breaker = None
+    if replicas is not None:
+        unregister_metrics("replicas")
+        replicas.dispose()
+        replicas = None
+
+
+def check_breaker() -> bool:
+    """Raises an exception DatabaseUnavailableException if requests to
+    the primary are stopped by the circuit breaker. Returns True if the request
+    is the probe of the half-open circuit: its success closes the circuit.
+    """
+    get_engine()
+    admission = breaker.admit()
+    if admission == OPEN:
+        raise DatabaseUnavailableException(breaker.retry_after())
+    return admission == HALF_OPEN
+
+
 def get_db() -> Session:
-    """Returns a session for the database."""
-    db = SessionLocal()
+    """Returns a session for the database. Fails fast if the circuit breaker
+    of the database is open.
+    """
+    probe = check_breaker()
+    db = create_session()
+    try:
+        yield db
+    except PoolTimeoutError:
+        # No connection of the pool has been released in time
+        breaker.record_failure()
+        raise
+    else:
+        if probe:
+            breaker.record_probe_success()
+    finally:
+        db.close()
+
+
+def reads_from_primary(request: Request) -> bool:
+    """Returns True if the client requires reading its own writes."""
+    return READ_PRIMARY_COOKIE in request.cookies or \
+        request.headers.get(READ_PRIMARY_HEADER, "").lower() in ("1", "true")
+
+
+def get_read_db(request: Request) -> Session:
+    """Returns a session for reads. If read replicas are configured, the session
+    is bound to an available replica, otherwise (and for clients that have
+    recently written) to the primary, unless its circuit breaker is open.
+    """
+    replica = None
+    probe = False
+    if replicas is not None and not reads_from_primary(request):
+        replica = replicas.choose()
+    if replica is None:
+        probe = check_breaker()
+
+    db = create_session(bind=replica)
     try:
         yield db
+    except DBAPIError:
+        if replica is not None:
+            replicas.mark_failed(replica)
+        raise
+    except PoolTimeoutError:
+        if replica is None:
+            breaker.record_failure()
+        raise
+    else:
+        if probe:
+            breaker.record_probe_success()
     finally:
         db.close()
+
+
+def mark_write(response: Response) -> None:
+    """Makes the client read from the primary while replicas can lag behind
+    its write (if read replicas are configured).
+    """
+    if replicas is not None:
+        response.set_cookie(
+            READ_PRIMARY_COOKIE, "1", max_age=math.ceil(replicas.max_lag) or 1
+        )
@@ -3,3 +3,33 @@ class UniqueViolationException(Exception):
 
     def __init__(self, *args, **kwargs):
         pass
+
+
+class DuplicateEventException(Exception):
+    """Raises when trying to re-apply an event with an already used idempotency key"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class UnsupportedFormatException(Exception):
+    """Raises when trying to import a file of an unsupported format"""
+
+
+class DatabaseUnavailableException(Exception):
+    """Raises when requests to the database are stopped by the circuit breaker"""
+
+    def __init__(self, retry_after: float = 0):
+        self.retry_after = retry_after
+
+
+class CoalescedFailureException(Exception):
+    """Raises in callers that waited for a coalesced computation that failed.
+    The original exception is raised only in the caller that ran the computation,
+    so that the failure is handled (for example, counted by the circuit breaker)
+    once.
+    """
+
+    def __init__(self, error: Exception):
+        super().__init__(f"The coalesced computation failed: {error!r}")
+        self.error = error
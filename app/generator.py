@@ -0,0 +1,46 @@
+import datetime
+import math
+import random
+from typing import Iterator
+
+# Share of days without views (a tracker was down) and of days without clicks
+ZERO_VIEWS_SHARE = .02
+ZERO_CLICKS_SHARE = .05
+# Median daily views, click-through rate and cost per click
+MEDIAN_VIEWS = 20_000
+MEDIAN_CTR = .02
+MEDIAN_CPC = .5
+# Relative views by day of the week (Monday first)
+WEEKLY_VIEWS = (1.1, 1.15, 1.15, 1.1, 1.0, .75, .7)
+# Yearly growth of views
+YEARLY_GROWTH = .2
+
+
+def generate_statistics(
+    years: float, start: datetime.date = datetime.date(2000, 1, 1), seed: int = None
+) -> Iterator[tuple[int, dict]]:
+    """Returns numbered rows of daily statistics for 'years' years starting from
+    'start' in the form accepted by importer.import_statistics.
+
+    Values have skewed (log-normal) distributions with weekly seasonality and
+    growth, some days have no views or no clicks, so that cpc and cpm are not
+    defined for them. The same seed returns the same statistics.
+    """
+    generator = random.Random(seed)
+    for day in range(round(years * 365)):
+        statistics_date = start + datetime.timedelta(days=day)
+        views = clicks = 0
+        cost = .0
+        if generator.random() >= ZERO_VIEWS_SHARE:
+            trend = (1 + YEARLY_GROWTH) ** (day / 365)
+            season = WEEKLY_VIEWS[statistics_date.weekday()]
+            views = round(
+                MEDIAN_VIEWS * trend * season * generator.lognormvariate(0, .5)
+            )
+            if generator.random() >= ZERO_CLICKS_SHARE:
+                ctr = MEDIAN_CTR * generator.lognormvariate(0, .4)
+                clicks = math.floor(views * min(ctr, 1))
+                cost = round(clicks * MEDIAN_CPC * generator.lognormvariate(0, .3), 2)
+        yield day + 1, {
+            "date": statistics_date, "views": views, "clicks": clicks, "cost": cost
+        }
@@ -0,0 +1,101 @@
+import threading
+import time
+from typing import Optional
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+from starlette.concurrency import run_in_threadpool
+
+from . import database
+from .breaker import OPEN
+from .settings import get_db_settings, get_health_settings
+
+router = APIRouter()
+
+
+class DatabasePing:
+    """The latency of 'SELECT 1' to the primary, cached for 'ping_interval'
+    seconds, so that frequent readiness checks do not load the database.
+    Checks made while a ping is in progress use the previous result.
+    """
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def check(self, ping_interval: float) -> None:
+        """Pings the database if the cached result is outdated."""
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            now = time.monotonic()
+            if self.checked_at is not None and now - self.checked_at < ping_interval:
+                return
+            started = time.perf_counter()
+            try:
+                with database.get_engine().connect() as connection:
+                    connection.execute(text("SELECT 1"))
+                self.latency, self.error = time.perf_counter() - started, None
+            except Exception as error:
+                self.latency, self.error = None, str(error)
+            self.checked_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+
+database_ping = DatabasePing()
+
+
+def _pool_state() -> dict:
+    """Returns the number of checked out connections of the pool of the primary
+    and the maximum number of connections (for pools of a limited size,
+    with the configured overflow).
+    """
+    pool = database.get_engine().pool
+    if not isinstance(pool, QueuePool):
+        return {"checked_out": None, "capacity": None}
+    max_overflow = get_db_settings().max_overflow
+    return {
+        "checked_out": pool.checkedout(),
+        "capacity": pool.size() + max_overflow if max_overflow >= 0 else None,
+    }
+
+
+@router.get("/health/live")
+async def liveness():
+    """Returns 200 while the worker process is running and its event loop responds."""
+    return {"status": "alive"}
+
+
+@router.get("/health/ready")
+async def readiness():
+    """Returns 200 if the worker can serve requests: the circuit breaker of
+    the database is not open, the connection pool has free connections and
+    the (cached) ping of the database is fast enough. Otherwise returns 503,
+    so that the load balancer stops sending requests to the worker.
+    """
+    settings = get_health_settings()
+    database.get_engine()
+    circuit = database.breaker.state
+    pool = _pool_state()
+    checks = {"circuit": circuit, "pool": pool}
+
+    ready = circuit != OPEN
+    if pool["capacity"] is not None and pool["checked_out"] >= pool["capacity"]:
+        ready = False
+    if ready:
+        await run_in_threadpool(database_ping.check, settings.ping_interval)
+        checks["database"] = {
+            "latency": database_ping.latency, "error": database_ping.error
+        }
+        ready = database_ping.latency is not None and \
+            database_ping.latency <= settings.max_ping
+
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not ready", "checks": checks},
+    )
@@ -0,0 +1,217 @@
+import codecs
+import csv
+import io
+import time
+from itertools import islice
+from typing import BinaryIO, Iterable, Iterator
+
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .crud import refresh_statistics_totals
+from .exceptions import UnsupportedFormatException
+from .live import track_changes
+from .settings import get_totals_settings
+from .tenants import DEFAULT_TENANT
+
+try:
+    import pyarrow.parquet as parquet
+except ImportError:  # Parquet support is optional
+    parquet = None
+
+CSV_FORMAT = "csv"
+PARQUET_FORMAT = "parquet"
+FORMATS = (CSV_FORMAT, PARQUET_FORMAT)
+
+# Number of rows validated and loaded at a time
+CHUNK_SIZE = 10_000
+# Maximum number of rejected rows described in the report
+MAX_REJECTED_DETAILS = 1000
+
+# Statistics of the import are summed up by date and added to the statistics
+MERGE_IMPORTED_STATISTICS = text(
+    "INSERT INTO statistic (tenant_id, date, views, clicks, cost) "
+    "SELECT :tenant_id, date, sum(views), sum(clicks), sum(cost) "
+    "FROM statistic_import GROUP BY date "
+    "ON CONFLICT (tenant_id, date) DO UPDATE SET "
+    "views = statistic.views + excluded.views, "
+    "clicks = statistic.clicks + excluded.clicks, "
+    "cost = statistic.cost + excluded.cost"
+)
+
+
+def detect_format(filename: str) -> str:
+    """Returns the format of the file by its extension (CSV by default)."""
+    return PARQUET_FORMAT if filename.lower().endswith(".parquet") else CSV_FORMAT
+
+
+def read_csv(file: BinaryIO) -> Iterator[tuple[int, dict]]:
+    """Returns rows of a CSV file with a header together with their line numbers."""
+    # The file is decoded line by line instead of with io.TextIOWrapper,
+    # which requires the 'readable' method missing in SpooledTemporaryFile
+    # of uploaded files before Python 3.11
+    reader = csv.DictReader(codecs.iterdecode(file, "utf-8-sig"))
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_parquet(file: BinaryIO) -> Iterator[tuple[int, dict]]:
+    """Returns rows of a Parquet file together with their numbers."""
+    if parquet is None:
+        raise UnsupportedFormatException("Parquet support requires pyarrow")
+    row_number = 0
+    for batch in parquet.ParquetFile(file).iter_batches(batch_size=CHUNK_SIZE):
+        for row in batch.to_pylist():
+            row_number += 1
+            yield row_number, row
+
+
+def read_rows(file: BinaryIO, file_format: str) -> Iterator[tuple[int, dict]]:
+    """Returns numbered rows of a file in the entered format."""
+    if file_format == CSV_FORMAT:
+        return read_csv(file)
+    if file_format == PARQUET_FORMAT:
+        return read_parquet(file)
+    raise UnsupportedFormatException(f"Unsupported format '{file_format}'")
+
+
+def _format_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in e['loc'])}: {e['msg']}" for e in error.errors()
+    )
+
+
+def _aggregate(rows: list[schemas.Statistics], tenant_id: str) -> list[dict]:
+    """Sums up the rows of the tenant by date."""
+    aggregated = dict()
+    for row in rows:
+        views, clicks, cost = aggregated.get(row.date, (0, 0, .0))
+        aggregated[row.date] = (views + row.views, clicks + row.clicks, cost + row.cost)
+    return [
+        {
+            "tenant_id": tenant_id, "date": date,
+            "views": views, "clicks": clicks, "cost": round(cost, 2),
+        }
+        for date, (views, clicks, cost) in aggregated.items()
+    ]
+
+
+class _CopyLoader:
+    """Loads rows into a temporary table with PostgreSQL COPY and merges
+    the table into the statistics of the tenant with one aggregated upsert.
+    """
+
+    def __init__(self, db: Session, tenant_id: str):
+        self.db = db
+        self.tenant_id = tenant_id
+        db.execute(text(
+            "CREATE TEMP TABLE statistic_import (date date NOT NULL, "
+            "views bigint NOT NULL, clicks bigint NOT NULL, "
+            "cost double precision NOT NULL) ON COMMIT DROP"
+        ))
+
+    def load(self, rows: list[schemas.Statistics]) -> None:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(
+            (row.date.isoformat(), row.views, row.clicks, row.cost) for row in rows
+        )
+        buffer.seek(0)
+        cursor = self.db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                "COPY statistic_import (date, views, clicks, cost) "
+                "FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        finally:
+            cursor.close()
+
+    def finish(self) -> None:
+        self.db.execute(MERGE_IMPORTED_STATISTICS, {"tenant_id": self.tenant_id})
+
+
+class _UpsertLoader:
+    """Sums up each chunk by date and adds it to the statistics with
+    an executemany upsert (used for SQLite).
+    """
+
+    def __init__(self, db: Session, tenant_id: str):
+        self.db = db
+        self.tenant_id = tenant_id
+        table = models.Statistics.__table__
+        statement = sqlite_insert(table)
+        self.statement = statement.on_conflict_do_update(
+            index_elements=[table.c.tenant_id, table.c.date],
+            set_={
+                "views": table.c.views + statement.excluded.views,
+                "clicks": table.c.clicks + statement.excluded.clicks,
+                "cost": table.c.cost + statement.excluded.cost,
+            },
+        )
+
+    def load(self, rows: list[schemas.Statistics]) -> None:
+        self.db.execute(self.statement, _aggregate(rows, self.tenant_id))
+
+    def finish(self) -> None:
+        pass
+
+
+def import_statistics(
+    db: Session, rows: Iterable[tuple[int, dict]], chunk_size: int = CHUNK_SIZE,
+    tenant_id: str = DEFAULT_TENANT,
+) -> schemas.ImportReport:
+    """Validates numbered rows in chunks with the rules of schemas.Statistics and
+    adds valid rows to the statistics of the tenant in one transaction (rows with
+    the same date are summed up). Invalid rows are rejected and described in the report.
+    Prefix sums (if maintained) are recomputed once from the earliest imported date.
+    """
+    started = time.perf_counter()
+    if db.get_bind().dialect.name == "postgresql":
+        loader = _CopyLoader(db, tenant_id)
+    else:
+        loader = _UpsertLoader(db, tenant_id)
+
+    imported = rejected_count = 0
+    rejected = []
+    first_date = None
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        valid_rows = []
+        for row_number, row in chunk:
+            # Empty values are treated as omitted, so that defaults are used
+            values = {
+                key: value for key, value in row.items()
+                if key is not None and value not in ("", None)
+            }
+            try:
+                valid_rows.append(schemas.Statistics(**values))
+            except ValidationError as error:
+                rejected_count += 1
+                if len(rejected) < MAX_REJECTED_DETAILS:
+                    rejected.append(
+                        schemas.RejectedRow(row=row_number, error=_format_error(error))
+                    )
+        if valid_rows:
+            loader.load(valid_rows)
+            track_changes(db, (row.date for row in valid_rows), tenant_id)
+            imported += len(valid_rows)
+            chunk_first_date = min(row.date for row in valid_rows)
+            first_date = min(first_date or chunk_first_date, chunk_first_date)
+
+    loader.finish()
+    # Prefix sums of all dates following the earliest imported one are changed
+    if first_date is not None and get_totals_settings().enabled:
+        refresh_statistics_totals(db, since=first_date, tenant_id=tenant_id)
+    db.commit()
+
+    seconds = time.perf_counter() - started
+    return schemas.ImportReport(
+        imported=imported,
+        rejected_count=rejected_count,
+        rejected=rejected,
+        seconds=round(seconds, 3),
+        rows_per_second=round(imported / seconds, 1) if seconds else imported,
+    )
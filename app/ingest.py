@@ -0,0 +1,438 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from itertools import count
+from pathlib import Path
+from typing import Optional, Union
+
+from sqlalchemy.orm import Session
+
+from .crud import (
+    get_ingest_checkpoint,
+    save_ingest_checkpoint,
+    summarize_statistics_batch
+)
+from .database import create_session, get_db
+from .metrics import register_metrics, unregister_metrics
+from .schemas import StatisticsEvent
+from .settings import IngestSettings, get_ingest_settings
+from .tenants import DEFAULT_TENANT
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".log"
+LOCK_FILE = "lock"
+# Maximum number of bytes read from a segment at a time
+READ_SIZE = 4 * 1024 * 1024
+# Period over which the apply throughput is calculated (seconds)
+THROUGHPUT_WINDOW = 60
+
+
+def _segment_path(directory: Path, segment: int) -> Path:
+    return directory / f"{segment:020d}{SEGMENT_SUFFIX}"
+
+
+def _list_segments(directory: Path) -> list[int]:
+    """Returns the sorted numbers of all segments in the directory."""
+    return sorted(int(path.stem) for path in directory.glob(f"*{SEGMENT_SUFFIX}"))
+
+
+def _claim_directory(base_directory: Path):
+    """Locks the first free subdirectory of the log for the current process.
+    Returns the subdirectory and the opened lock file (the lock is held while
+    the file is open), so that each worker process writes its own log and
+    replays it after restart.
+    """
+    for number in count():
+        directory = base_directory / f"worker-{number}"
+        directory.mkdir(parents=True, exist_ok=True)
+        lock_file = open(directory / LOCK_FILE, "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            continue
+        return directory, lock_file
+
+
+def _claim_orphaned_directories(
+    base_directory: Path, own_directory: Path
+) -> list[tuple[Path, object]]:
+    """Locks the subdirectories of the log that are not used by any running
+    worker process and still have events (for example, after a restart with
+    fewer workers). Returns the subdirectories and their opened lock files.
+    """
+    orphaned = []
+    for directory in sorted(base_directory.glob("worker-*")):
+        if directory == own_directory or not any(
+            _segment_path(directory, segment).stat().st_size
+            for segment in _list_segments(directory)
+        ):
+            continue
+        lock_file = open(directory / LOCK_FILE, "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            continue
+        orphaned.append((directory, lock_file))
+    return orphaned
+
+
+class IngestLog:
+    """Append-only log of validated statistics events split into segment files.
+
+    Each event is a line of JSON. Concurrent writers share fsync calls
+    (group commit): an event is durable when 'append' returns, but a single
+    fsync covers all events written before it.
+    """
+
+    def __init__(self, directory: Path, segment_size: int):
+        self.directory = directory
+        self.segment_size = segment_size
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._written = 0
+        self._synced = 0
+
+        # A new segment is always started, so that the segments written before
+        # the restart (possibly with a torn last line) are never appended
+        segments = _list_segments(directory)
+        self._segment = segments[-1] + 1 if segments else 0
+        self._file = open(_segment_path(directory, self._segment), "ab")
+
+    @property
+    def segment(self) -> int:
+        """Number of the segment being written."""
+        return self._segment
+
+    def append(self, event: StatisticsEvent, tenant_id: str = DEFAULT_TENANT) -> None:
+        """Appends the event of the tenant to the log and waits until it is
+        synced to disk.
+        """
+        record = event.dict()
+        record["date"] = str(event.date)
+        record["tenant"] = tenant_id
+        record["t"] = time.time()
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+
+        with self._write_lock:
+            if self._file.tell() and self._file.tell() + len(line) > self.segment_size:
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+            self._written += 1
+            sequence = self._written
+
+        self._sync(sequence)
+
+    def _rotate(self) -> None:
+        """Syncs and closes the current segment and starts the next one.
+        Must be called with the write lock held.
+        """
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._segment += 1
+        self._file = open(_segment_path(self.directory, self._segment), "ab")
+
+    def _sync(self, sequence: int) -> None:
+        """Syncs the log to disk if the event with the sequence number
+        has not been synced by another writer yet.
+        """
+        with self._sync_lock:
+            if self._synced >= sequence:
+                return
+            # The descriptor is duplicated, so that the segment stays open
+            # for fsync even if it is closed by a concurrent rotation
+            with self._write_lock:
+                target = self._written
+                descriptor = os.dup(self._file.fileno())
+            try:
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+            self._synced = target
+
+    def close(self) -> None:
+        """Syncs and closes the log."""
+        with self._write_lock:
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+
+class OrphanedLog:
+    """A subdirectory of the log that is no longer written by any worker
+    process, so all its segments are complete.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        segments = _list_segments(directory)
+        self.segment = segments[-1] + 1 if segments else 0
+
+
+class IngestConsumer:
+    """Applies events of the ingest log to the database in aggregated batches.
+
+    The position in the log is saved in the same transaction as the statistics,
+    so after a restart the log is replayed from the last applied event.
+    Fully applied segments are deleted.
+    """
+
+    def __init__(
+        self, log: Union[IngestLog, OrphanedLog], batch_size: int,
+        poll_interval: float,
+        session_factory=create_session
+    ):
+        self.log = log
+        self.session_factory = session_factory
+        self.name = str(log.directory.resolve())
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.segment = None
+        self.offset = 0
+        self.applied_events = 0
+        self.last_applied_at = None
+        self._applied = deque()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="ingest-consumer", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the consumer after the current batch."""
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                applied = self.apply_next_batch()
+            except Exception:
+                logger.exception("Failed to apply the ingest log %s", self.name)
+                applied = 0
+            if not applied:
+                self._stop.wait(self.poll_interval)
+
+    def _load_checkpoint(self) -> None:
+        db = self.session_factory()
+        try:
+            checkpoint = get_ingest_checkpoint(db, self.name)
+        finally:
+            db.close()
+        # The list is never empty, since the segment being written exists
+        segments = _list_segments(self.log.directory)
+        if checkpoint is not None and checkpoint.segment in segments:
+            self.segment, self.offset = checkpoint.segment, checkpoint.offset
+        else:
+            self.segment, self.offset = segments[0], 0
+
+    def _read_batch(self) -> tuple[dict[str, list[StatisticsEvent]], int, float]:
+        """Reads complete events starting from the current position.
+        Returns the events by tenant, the offset after them and the time
+        of the last event.
+        """
+        path = _segment_path(self.log.directory, self.segment)
+        if not path.exists():
+            return {}, self.offset, None
+        with open(path, "rb") as file:
+            file.seek(self.offset)
+            data = file.read(READ_SIZE)
+
+        events = {}
+        read = 0
+        offset = self.offset
+        last_time = None
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n") or read >= self.batch_size:
+                break
+            offset += len(line)
+            read += 1
+            try:
+                record = json.loads(line)
+                last_time = record.pop("t", None)
+                # Events written before tenants were introduced have no tenant
+                tenant_id = record.pop("tenant", DEFAULT_TENANT)
+                events.setdefault(tenant_id, []).append(StatisticsEvent(**record))
+            except ValueError:
+                logger.error(
+                    "Skipped a corrupted event in %s at offset %d",
+                    path, offset - len(line)
+                )
+        return events, offset, last_time
+
+    def apply_next_batch(self) -> int:
+        """Applies the next batch of events to the database and moves
+        the checkpoint. Returns 0 if there is nothing to apply yet.
+        """
+        if self.segment is None:
+            self._load_checkpoint()
+        events, offset, last_time = self._read_batch()
+        segment = self.segment
+
+        if offset == self.offset:
+            # The segment is fully applied if the writer has moved to the next one
+            if self.segment >= self.log.segment:
+                return 0
+            segment, offset = self.segment + 1, 0
+
+        db = self.session_factory()
+        try:
+            applied = sum(
+                summarize_statistics_batch(db, tenant_events, tenant_id)
+                for tenant_id, tenant_events in events.items()
+            )
+            save_ingest_checkpoint(db, self.name, segment, offset)
+            db.commit()
+        finally:
+            db.close()
+
+        if segment != self.segment:
+            _segment_path(self.log.directory, self.segment).unlink(missing_ok=True)
+        self.segment, self.offset = segment, offset
+        if events:
+            self._record_applied(applied, last_time)
+        return sum(len(tenant_events) for tenant_events in events.values()) or 1
+
+    def _record_applied(self, applied: int, last_time: Optional[float]) -> None:
+        now = time.time()
+        self.applied_events += applied
+        self.last_applied_at = last_time
+        self._applied.append((now, applied))
+        while self._applied and self._applied[0][0] < now - THROUGHPUT_WINDOW:
+            self._applied.popleft()
+
+    def metrics(self) -> dict:
+        """Returns the queue lag, the number of segments and the apply throughput."""
+        segments = _list_segments(self.log.directory)
+        lag_bytes = 0
+        for segment in segments:
+            if self.segment is not None and segment < self.segment:
+                continue
+            path = _segment_path(self.log.directory, segment)
+            lag_bytes += path.stat().st_size if path.exists() else 0
+            if segment == self.segment:
+                lag_bytes -= self.offset
+        now = time.time()
+        applied_recently = sum(
+            applied for applied_at, applied in self._applied
+            if applied_at >= now - THROUGHPUT_WINDOW
+        )
+        return {
+            "lag_bytes": lag_bytes,
+            "lag_seconds": (
+                round(now - self.last_applied_at, 3)
+                if lag_bytes and self.last_applied_at else 0
+            ),
+            "segments": len(segments),
+            "applied_events": self.applied_events,
+            "apply_rate": round(applied_recently / THROUGHPUT_WINDOW, 2),
+        }
+
+
+# Log and consumer of the current worker process (None if the mode is disabled)
+_ingest_log: Optional[IngestLog] = None
+_ingest_consumer: Optional[IngestConsumer] = None
+_lock_file = None
+# Thread that applies the events of orphaned subdirectories of the log
+_drain_thread: Optional[threading.Thread] = None
+_drain_stop = threading.Event()
+
+
+def drain_orphaned_directories(
+    orphaned: list[tuple[Path, object]], settings: IngestSettings,
+    stop: threading.Event, session_factory=create_session
+) -> None:
+    """Applies all events of the orphaned subdirectories of the log and
+    releases their locks, so that events written by worker processes that
+    no longer exist are not left unapplied.
+    """
+    for directory, lock_file in orphaned:
+        try:
+            consumer = IngestConsumer(
+                OrphanedLog(directory), settings.batch_size, settings.poll_interval,
+                session_factory=session_factory,
+            )
+            while not stop.is_set():
+                try:
+                    if not consumer.apply_next_batch():
+                        break
+                except Exception:
+                    logger.exception("Failed to apply the ingest log %s", directory)
+                    stop.wait(settings.poll_interval)
+        finally:
+            lock_file.close()
+
+
+def get_ingest_log() -> Optional[IngestLog]:
+    """Returns the ingest log of the current process or None if the mode is disabled."""
+    return _ingest_log
+
+
+def get_write_db() -> Optional[Session]:
+    """Returns a session for saving events or None if the ingest log is enabled.
+    Events are then written to the log without checking the circuit breaker,
+    so that they are accepted while the database is unavailable.
+    """
+    if _ingest_log is not None:
+        yield None
+        return
+    yield from get_db()
+
+
+def start_ingest(settings: IngestSettings = None) -> None:
+    """Opens the ingest log and starts the consumer if the mode is enabled.
+    Events left in subdirectories of worker processes that no longer run
+    are applied in the background.
+    """
+    global _ingest_log, _ingest_consumer, _lock_file, _drain_thread
+    settings = settings or get_ingest_settings()
+    if not settings.enabled:
+        return
+
+    base_directory = Path(settings.directory)
+    directory, _lock_file = _claim_directory(base_directory)
+    _ingest_log = IngestLog(directory, settings.segment_size)
+    _ingest_consumer = IngestConsumer(
+        _ingest_log, settings.batch_size, settings.poll_interval
+    )
+    _ingest_consumer.start()
+    register_metrics("ingest", _ingest_consumer.metrics)
+
+    orphaned = _claim_orphaned_directories(base_directory, directory)
+    if orphaned:
+        _drain_stop.clear()
+        _drain_thread = threading.Thread(
+            target=drain_orphaned_directories,
+            args=(orphaned, settings, _drain_stop),
+            name="ingest-drain", daemon=True,
+        )
+        _drain_thread.start()
+
+
+def stop_ingest() -> None:
+    """Stops the consumer and closes the ingest log. Events that have not been
+    applied yet remain in the log and are replayed after restart.
+    """
+    global _ingest_log, _ingest_consumer, _lock_file, _drain_thread
+    if _ingest_log is None:
+        return
+
+    unregister_metrics("ingest")
+    if _drain_thread is not None:
+        _drain_stop.set()
+        _drain_thread.join()
+        _drain_thread = None
+    # New events are not accepted into the log while it is being closed
+    log, _ingest_log = _ingest_log, None
+    _ingest_consumer.stop()
+    log.close()
+    _lock_file.close()
+    _ingest_consumer = _lock_file = None
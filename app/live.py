@@ -0,0 +1,336 @@
+import asyncio
+import datetime
+import json
+import logging
+import select
+import threading
+from typing import Iterable, Optional
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+from .database import create_session, get_engine
+from .metrics import register_metrics, unregister_metrics
+from .services import get_returns_statistics
+from .settings import LiveSettings, get_live_settings
+from .tenants import DEFAULT_TENANT
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL channel used to deliver changes to all worker processes
+NOTIFY_CHANNEL = "statistics_changes"
+# Payload of a change that requires subscribers to re-read all statistics
+RESYNC = "resync"
+# Changes of more dates are delivered as a resync (the NOTIFY payload is limited)
+MAX_NOTIFIED_DATES = 500
+# Key of the changed dates in the session info
+CHANGES_KEY = "statistics_changes"
+
+# Changes are dictionaries of changed dates (or a resync) by tenant. A resync
+# instead of the dictionary means that statistics of all tenants have changed
+
+
+def track_changes(
+    db: Session, dates: Iterable[datetime.date], tenant_id: str = DEFAULT_TENANT
+) -> None:
+    """Remembers the dates of statistics of the tenant changed in the transaction
+    of the session. Subscribers are notified when the transaction is committed.
+    """
+    tenant_changes = db.info.setdefault(CHANGES_KEY, {}).setdefault(tenant_id, set())
+    if tenant_changes != RESYNC:
+        tenant_changes.update(dates)
+
+
+def track_resync(db: Session, tenant_id: str = DEFAULT_TENANT) -> None:
+    """Remembers that all statistics of the tenant are changed in the transaction
+    of the session.
+    """
+    db.info.setdefault(CHANGES_KEY, {})[tenant_id] = RESYNC
+
+
+def _encode_changes(changes: dict) -> str:
+    changed_dates = sum(
+        len(tenant_changes) for tenant_changes in changes.values()
+        if tenant_changes != RESYNC
+    )
+    return json.dumps({
+        tenant_id: (
+            RESYNC if tenant_changes == RESYNC or changed_dates > MAX_NOTIFIED_DATES
+            else sorted(str(changed_date) for changed_date in tenant_changes)
+        )
+        for tenant_id, tenant_changes in changes.items()
+    }, separators=(",", ":"))
+
+
+def _decode_changes(payload: str) -> dict:
+    return {
+        tenant_id: (
+            RESYNC if tenant_changes == RESYNC
+            else {datetime.date.fromisoformat(value) for value in tenant_changes}
+        )
+        for tenant_id, tenant_changes in json.loads(payload).items()
+    }
+
+
+@event.listens_for(Session, "before_commit")
+def _notify_before_commit(db: Session) -> None:
+    """Sends the changes with NOTIFY in the committed transaction (PostgreSQL),
+    so that listeners of all worker processes receive them after the commit.
+    """
+    changes = db.info.get(CHANGES_KEY)
+    if changes and db.get_bind().dialect.name == "postgresql":
+        db.execute(func.pg_notify(NOTIFY_CHANNEL, _encode_changes(changes)).select())
+        db.info.pop(CHANGES_KEY)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_after_commit(db: Session) -> None:
+    """Publishes the changes in the current process (databases without NOTIFY)."""
+    changes = db.info.pop(CHANGES_KEY, None)
+    if changes and _broker is not None:
+        _broker.publish(changes)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_after_rollback(db: Session, previous_transaction) -> None:
+    db.info.pop(CHANGES_KEY, None)
+
+
+class Subscription:
+    """A subscriber to changes of statistics of the tenant in the date range.
+
+    Messages wait in a bounded queue. If the subscriber does not keep up and
+    the queue is full, pending messages are replaced with a single resync
+    message, after which the subscriber should re-read the statistics.
+    """
+
+    def __init__(
+        self, date_from: Optional[datetime.date],
+        date_to: Optional[datetime.date], max_pending: int,
+        tenant_id: str = DEFAULT_TENANT
+    ):
+        self.tenant_id = tenant_id
+        self.date_from = date_from
+        self.date_to = date_to
+        self.overflows = 0
+        self._queue = asyncio.Queue(maxsize=max_pending)
+
+    def matches(self, statistics_date: datetime.date) -> bool:
+        return (self.date_from is None or statistics_date >= self.date_from) and \
+            (self.date_to is None or statistics_date <= self.date_to)
+
+    def put(self, message: dict) -> None:
+        if self._queue.full():
+            self.overflows += 1
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            message = {"type": RESYNC}
+        self._queue.put_nowait(message)
+
+    async def get(self) -> dict:
+        return await self._queue.get()
+
+
+class ChangeBroker:
+    """Collects changed dates of statistics and once per tick sends the current
+    statistics of these dates to subscribers whose range includes them.
+    """
+
+    def __init__(self, tick: float, max_pending: int):
+        self.tick = tick
+        self.max_pending = max_pending
+        self.subscriptions = set()
+        self.delivered_messages = 0
+        self._changes = {}
+        self._lock = threading.Lock()
+
+    def publish(self, changes) -> None:
+        """Adds changes (or a resync of all tenants) to the next tick. Thread-safe."""
+        with self._lock:
+            if changes == RESYNC or self._changes == RESYNC:
+                self._changes = RESYNC
+                return
+            for tenant_id, tenant_changes in changes.items():
+                if tenant_changes == RESYNC or self._changes.get(tenant_id) == RESYNC:
+                    self._changes[tenant_id] = RESYNC
+                else:
+                    self._changes.setdefault(tenant_id, set()).update(tenant_changes)
+
+    def subscribe(
+        self, date_from: datetime.date = None, date_to: datetime.date = None,
+        tenant_id: str = DEFAULT_TENANT
+    ) -> Subscription:
+        subscription = Subscription(date_from, date_to, self.max_pending, tenant_id)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.subscriptions.discard(subscription)
+
+    async def run(self) -> None:
+        """Delivers collected changes every tick until the task is cancelled."""
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.deliver()
+            except Exception:
+                logger.exception("Failed to deliver statistics changes")
+
+    async def deliver(self) -> None:
+        """Sends the changes collected since the previous call to subscribers."""
+        with self._lock:
+            changes, self._changes = self._changes, {}
+        if not changes or not self.subscriptions:
+            return
+
+        if changes == RESYNC:
+            self._resync(list(self.subscriptions))
+            return
+
+        for tenant_id, tenant_changes in changes.items():
+            subscriptions = [
+                subscription for subscription in self.subscriptions
+                if subscription.tenant_id == tenant_id
+            ]
+            if tenant_changes == RESYNC:
+                self._resync(subscriptions)
+            elif subscriptions:
+                await self._deliver_dates(tenant_id, tenant_changes, subscriptions)
+
+    def _resync(self, subscriptions: list[Subscription]) -> None:
+        for subscription in subscriptions:
+            subscription.put({"type": RESYNC})
+            self.delivered_messages += 1
+
+    async def _deliver_dates(
+        self, tenant_id: str, dates: set[datetime.date],
+        subscriptions: list[Subscription]
+    ) -> None:
+        subscribed_dates = [
+            changed_date for changed_date in dates
+            if any(subscription.matches(changed_date) for subscription in subscriptions)
+        ]
+        if not subscribed_dates:
+            return
+        statistics = await run_in_threadpool(
+            _read_statistics, tenant_id, subscribed_dates
+        )
+
+        for subscription in subscriptions:
+            matched = [stat for stat in statistics if subscription.matches(stat.date)]
+            if matched:
+                subscription.put({
+                    "type": "delta",
+                    "statistics": jsonable_encoder(get_returns_statistics(matched)),
+                })
+                self.delivered_messages += 1
+
+    def metrics(self) -> dict:
+        return {
+            "subscribers": len(self.subscriptions),
+            "delivered_messages": self.delivered_messages,
+            "overflows": sum(
+                subscription.overflows for subscription in self.subscriptions
+            ),
+        }
+
+
+def _read_statistics(
+    tenant_id: str, dates: list[datetime.date]
+) -> list[models.Statistics]:
+    db = create_session()
+    try:
+        return db.query(models.Statistics).filter(
+            models.Statistics.tenant_id == tenant_id,
+            models.Statistics.date.in_(dates),
+        ).all()
+    finally:
+        db.close()
+
+
+class NotificationListener:
+    """Receives changes sent by all worker processes with PostgreSQL NOTIFY
+    and publishes them to the broker of the current process.
+    """
+
+    def __init__(self, engine: Engine, broker: ChangeBroker):
+        self.engine = engine
+        self.broker = broker
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="statistics-listener", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Failed to listen to statistics changes")
+                # Changes could have been missed while reconnecting
+                self.broker.publish(RESYNC)
+                self._stop.wait(1)
+
+    def _listen(self) -> None:
+        # The connection is detached, so that it does not occupy the pool
+        connection = self.engine.raw_connection()
+        connection.detach()
+        try:
+            dbapi_connection = connection.connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            while not self._stop.is_set():
+                if select.select([dbapi_connection], [], [], 1) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    self.broker.publish(_decode_changes(notify.payload))
+        finally:
+            connection.close()
+
+
+# Broker of the current process (None if the live feed is not started)
+_broker: Optional[ChangeBroker] = None
+_broker_task: Optional[asyncio.Task] = None
+_listener: Optional[NotificationListener] = None
+
+
+def get_broker() -> Optional[ChangeBroker]:
+    return _broker
+
+
+def start_live(settings: LiveSettings = None) -> None:
+    """Starts delivering changes to subscribers (called in the event loop)."""
+    global _broker, _broker_task, _listener
+    settings = settings or get_live_settings()
+    _broker = ChangeBroker(settings.tick, settings.max_pending)
+    _broker_task = asyncio.create_task(_broker.run())
+    engine = get_engine()
+    if engine.dialect.name == "postgresql":
+        _listener = NotificationListener(engine, _broker)
+        _listener.start()
+    register_metrics("live", _broker.metrics)
+
+
+def stop_live() -> None:
+    global _broker, _broker_task, _listener
+    if _broker is None:
+        return
+    unregister_metrics("live")
+    if _listener is not None:
+        _listener.stop()
+    _broker_task.cancel()
+    _broker = _broker_task = _listener = None
@@ -1,28 +1,29 @@
+import asyncio
+import math
+
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
 
-from . import router
-from .exceptions import UniqueViolationException
-
-
-app = FastAPI(
-    title="StatisticsCounterService",
-    version="0.1",
-    description="A service for maintaining statistics. It is possible"
-    "to update statistics (add new ones and add new ones to the old one), "
-    "view statistics for a certain period of time with filtering, "
-    "and also clean up all available statistics.",
-)
-
-# Include statistics routers (/api/statistics)
-app.include_router(
-    router.router,
-    prefix="/api",
-    tags=["statistics"]
+from . import health, router
+from .compression import CompressionMiddleware
+from .database import dispose_engine, init_engine, use_engine, warm_pool
+from .exceptions import (
+    DatabaseUnavailableException,
+    DuplicateEventException,
+    UniqueViolationException,
+    UnsupportedFormatException
 )
+from .ingest import start_ingest, stop_ingest
+from .live import start_live, stop_live
+from .metrics import register_metrics, unregister_metrics
+from .ratelimit import RateLimiter, RateLimitMiddleware
+from .settings import DatabaseSettings, get_db_settings
+from .singleflight import statistics_reads
+from .tasks import purge_idempotency_keys_periodically
 
 
-@app.exception_handler(UniqueViolationException)
 def unique_violation_exception_handler(
         request: Request, exception: UniqueViolationException
 ):
@@ -30,3 +31,109 @@ def unique_violation_exception_handler(
         status_code=400,
         content={"message": "An object with such a key already exists"}
     )
+
+
+def duplicate_event_exception_handler(
+        request: Request, exception: DuplicateEventException
+):
+    return JSONResponse(
+        status_code=200,
+        content={"message": "An event with such an idempotency key has already "
+                            "been applied"}
+    )
+
+
+def unsupported_format_exception_handler(
+        request: Request, exception: UnsupportedFormatException
+):
+    return JSONResponse(status_code=400, content={"message": str(exception)})
+
+
+def database_unavailable_exception_handler(
+        request: Request, exception: DatabaseUnavailableException
+):
+    return JSONResponse(
+        status_code=503,
+        content={"message": "The database is temporarily unavailable"},
+        headers={"Retry-After": str(math.ceil(exception.retry_after) or 1)},
+    )
+
+
+def create_app(db_settings: DatabaseSettings = None, engine: Engine = None) -> FastAPI:
+    """Returns the application. The database engine is created on startup
+    from 'db_settings' (by default from the environment file), unless
+    a ready 'engine' is entered (for example, a test one).
+    """
+    app = FastAPI(
+        title="StatisticsCounterService",
+        version="0.1",
+        description="A service for maintaining statistics. It is possible"
+        "to update statistics (add new ones and add new ones to the old one), "
+        "view statistics for a certain period of time with filtering, "
+        "and also clean up all available statistics.",
+    )
+
+    app.add_middleware(CompressionMiddleware)
+    # Rejected requests do not reach the compression and the handlers
+    limiter = app.state.rate_limiter = RateLimiter()
+    app.add_middleware(RateLimitMiddleware, limiter=limiter)
+
+    # Include statistics routers (/api/statistics)
+    app.include_router(
+        router.router,
+        prefix="/api",
+        tags=["statistics"]
+    )
+    # Include health checks (/health/live, /health/ready)
+    app.include_router(health.router, tags=["health"])
+
+    app.add_exception_handler(
+        UniqueViolationException, unique_violation_exception_handler
+    )
+    app.add_exception_handler(
+        DuplicateEventException, duplicate_event_exception_handler
+    )
+    app.add_exception_handler(
+        UnsupportedFormatException, unsupported_format_exception_handler
+    )
+    app.add_exception_handler(
+        DatabaseUnavailableException, database_unavailable_exception_handler
+    )
+
+    @app.on_event("startup")
+    async def startup():
+        """Creates the database engine of the worker process, opens connections
+        of the pool and starts background tasks.
+        """
+        if engine is not None:
+            use_engine(engine)
+        else:
+            settings = db_settings or get_db_settings()
+            init_engine(settings)
+            await run_in_threadpool(warm_pool, settings.pool_size)
+
+        app.state.purge_task = asyncio.create_task(
+            purge_idempotency_keys_periodically()
+        )
+        start_ingest()
+        start_live()
+        register_metrics("singleflight", statistics_reads.metrics)
+        register_metrics("ratelimit", limiter.metrics)
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        """Stops background tasks and closes connections of the pool. The server
+        calls it after in-flight requests have been completed.
+        """
+        app.state.purge_task.cancel()
+        stop_ingest()
+        stop_live()
+        unregister_metrics("singleflight")
+        unregister_metrics("ratelimit")
+        if engine is None:
+            dispose_engine()
+
+    return app
+
+
+app = create_app()
@@ -0,0 +1,19 @@
+from typing import Callable
+
+# Metric providers by name. Each provider returns a dictionary of current values
+_providers: dict[str, Callable[[], dict]] = {}
+
+
+def register_metrics(name: str, provider: Callable[[], dict]) -> None:
+    """Registers a metrics provider (replaces a provider with the same name)."""
+    _providers[name] = provider
+
+
+def unregister_metrics(name: str) -> None:
+    """Removes a metrics provider if it has been registered."""
+    _providers.pop(name, None)
+
+
+def collect_metrics() -> dict:
+    """Returns current values of all registered metrics grouped by provider name."""
+    return {name: provider() for name, provider in _providers.items()}
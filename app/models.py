@@ -1,13 +1,64 @@
-from sqlalchemy import Column, Date, Float, Integer
+from datetime import datetime
+
+from sqlalchemy import BigInteger, Column, Date, DateTime, Float, Integer, String
 
 from .database import Base
+from .tenants import DEFAULT_TENANT, TENANT_ID_MAX_LENGTH
 
 
 class Statistics(Base):
-    """The model of statistics. Statistics are stored by date."""
+    """The model of statistics. Statistics are stored by tenant and date
+    (on PostgreSQL the table can be partitioned by tenant).
+    """
     __tablename__ = "statistic"
 
-    date = Column(Date, primary_key=True, index=True, unique=True)
+    tenant_id = Column(
+        String(TENANT_ID_MAX_LENGTH), primary_key=True,
+        default=DEFAULT_TENANT, server_default=DEFAULT_TENANT
+    )
+    date = Column(Date, primary_key=True)
     views = Column(Integer, nullable=False)
     clicks = Column(Integer, nullable=False)
     cost = Column(Float, nullable=False)
+
+
+class IdempotencyKey(Base):
+    """The model of an idempotency key of an already applied statistics event.
+    Keys are stored for a limited time and are purged in bulk by 'created_at'.
+    """
+    __tablename__ = "idempotency_key"
+
+    tenant_id = Column(
+        String(TENANT_ID_MAX_LENGTH), primary_key=True,
+        default=DEFAULT_TENANT, server_default=DEFAULT_TENANT
+    )
+    key = Column(String(64), primary_key=True)
+    created_at = Column(DateTime, nullable=False, index=True, default=datetime.utcnow)
+
+
+class IngestCheckpoint(Base):
+    """The model of a position of the local ingest log up to which events
+    have been applied to the database.
+    """
+    __tablename__ = "ingest_checkpoint"
+
+    log = Column(String(255), primary_key=True)
+    segment = Column(Integer, nullable=False)
+    offset = Column(BigInteger, nullable=False)
+
+
+class StatisticsTotal(Base):
+    """The model of a prefix sum of statistics: totals of all statistics of
+    the tenant up to the date (inclusive). Stored for each date of statistics,
+    so that the total of any date period is the difference of two prefix sums.
+    """
+    __tablename__ = "statistic_total"
+
+    tenant_id = Column(
+        String(TENANT_ID_MAX_LENGTH), primary_key=True,
+        default=DEFAULT_TENANT, server_default=DEFAULT_TENANT
+    )
+    date = Column(Date, primary_key=True)
+    views = Column(BigInteger, nullable=False)
+    clicks = Column(BigInteger, nullable=False)
+    cost = Column(Float, nullable=False)
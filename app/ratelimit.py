@@ -0,0 +1,256 @@
+import asyncio
+import math
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .settings import (
+    RateLimitSettings,
+    TenantSettings,
+    get_db_settings,
+    get_rate_limit_settings,
+    get_tenant_settings
+)
+from .tenants import resolve_tenant
+
+# Routes under this path use the database and are limited
+LIMITED_PATH = "/api/statistics"
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+# Seconds after which a client may retry a request rejected due to overload
+OVERLOAD_RETRY_AFTER = 1
+
+
+class RateLimitBackend(ABC):
+    """Storage of token buckets of clients.
+
+    The in-memory backend limits each worker process separately. A shared
+    store (for example Redis) can implement 'take' atomically to apply
+    the limits across all worker processes and hosts.
+    """
+
+    @abstractmethod
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        """Takes a token from the bucket 'key' that is refilled with 'rate' tokens
+        per second up to 'burst' tokens. Returns 0 if the token has been taken
+        or the number of seconds until a token is available.
+        """
+
+    def metrics(self) -> dict:
+        return {}
+
+
+class MemoryBackend(RateLimitBackend):
+    """Token buckets in the memory of the current process. Buckets that have
+    been refilled are dropped when there are more than 'max_buckets' of them.
+    """
+
+    def __init__(self, max_buckets: int = 100_000):
+        self.max_buckets = max_buckets
+        # Bucket key: (tokens, time of the update, time when the bucket is full)
+        self._buckets: dict[str, tuple[float, float, float]] = {}
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = .0
+        else:
+            wait = (1 - tokens) / rate
+
+        if key not in self._buckets and len(self._buckets) >= self.max_buckets:
+            self._drop_full_buckets(now)
+        self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+        return wait
+
+    def _drop_full_buckets(self, now: float) -> None:
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items() if bucket[2] > now
+        }
+
+    def metrics(self) -> dict:
+        return {"buckets": len(self._buckets)}
+
+
+class RateLimiter:
+    """Limits the rate of requests of each client on each route and the rate
+    of writes of each tenant (write quotas) with token buckets and the number
+    of requests handled at once by the worker process.
+    The configuration is read on the first request.
+    """
+
+    def __init__(
+        self, settings: RateLimitSettings = None, backend: RateLimitBackend = None,
+        tenant_settings: TenantSettings = None
+    ):
+        self.settings = settings
+        self.tenant_settings = tenant_settings
+        self.backend = backend or MemoryBackend()
+        self.in_flight = 0
+        self.rate_limited = 0
+        self.quota_exceeded = 0
+        self.overloaded = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = None
+
+    def get_settings(self) -> RateLimitSettings:
+        self.settings = self.settings or get_rate_limit_settings()
+        return self.settings
+
+    def get_tenant_settings(self) -> TenantSettings:
+        self.tenant_settings = self.tenant_settings or get_tenant_settings()
+        return self.tenant_settings
+
+    def get_max_concurrent(self) -> int:
+        """Returns the number of requests handled at once: by default the size
+        of the connection pool (without overflow if it is unlimited).
+        """
+        settings = self.get_settings()
+        if settings.max_concurrent is not None:
+            return settings.max_concurrent
+        db_settings = get_db_settings()
+        return db_settings.pool_size + max(db_settings.max_overflow, 0)
+
+    def get_limits(self, method: str, path: str) -> tuple[float, int]:
+        """Returns the rate and the burst of the route."""
+        settings = self.get_settings()
+        route_limits = settings.routes.get(f"{method} {path}")
+        if route_limits is not None:
+            return route_limits
+        if method in WRITE_METHODS:
+            return settings.write_rate, settings.write_burst
+        return settings.read_rate, settings.read_burst
+
+    def get_client(self, scope: Scope) -> str:
+        """Returns the API key of the client or its IP address."""
+        api_key = Headers(scope=scope).get(self.get_settings().api_key_header)
+        if api_key:
+            return f"key:{api_key}"
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+
+    async def check_rate(self, scope: Scope) -> float:
+        """Takes a token of the client on the route of the request. Returns 0
+        if the request is allowed or the number of seconds to wait.
+        """
+        method, path = scope["method"], scope["path"]
+        rate, burst = self.get_limits(method, path)
+        wait = await self.backend.take(
+            f"{self.get_client(scope)} {method} {path}", rate, burst
+        )
+        if wait:
+            self.rate_limited += 1
+        return wait
+
+    async def check_quota(self, scope: Scope) -> float:
+        """Takes a token of the write quota of the tenant of the request.
+        Returns 0 if the request is allowed (reads, tenants without a quota and
+        unknown API keys, which are rejected by the handlers) or the number
+        of seconds to wait.
+        """
+        if scope["method"] not in WRITE_METHODS:
+            return 0
+        settings = self.get_tenant_settings()
+        tenant_id = resolve_tenant(
+            Headers(scope=scope).get(settings.api_key_header), settings
+        )
+        if tenant_id is None:
+            return 0
+        rate, burst = settings.quotas.get(
+            tenant_id, (settings.write_rate, settings.write_burst)
+        )
+        if not rate:
+            return 0
+        wait = await self.backend.take(f"tenant:{tenant_id}", rate, burst)
+        if wait:
+            self.quota_exceeded += 1
+        return wait
+
+    async def acquire(self) -> bool:
+        """Waits up to 'queue_timeout' seconds for a free slot. Returns False
+        if the worker is still handling 'max_concurrent' requests.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.get_max_concurrent())
+            self._loop = loop
+        try:
+            await asyncio.wait_for(
+                self._semaphore.acquire(), self.get_settings().queue_timeout
+            )
+        except asyncio.TimeoutError:
+            self.overloaded += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def metrics(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "rate_limited": self.rate_limited,
+            "quota_exceeded": self.quota_exceeded,
+            "overloaded": self.overloaded,
+            **self.backend.metrics(),
+        }
+
+
+def _rejection(status_code: int, message: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"message": message},
+        headers={"Retry-After": str(math.ceil(retry_after))},
+    )
+
+
+class RateLimitMiddleware:
+    """Rejects requests to the statistics over the rate of the client or over
+    the write quota of the tenant with 429 and requests over the concurrency
+    limit with 503 instead of queueing them for the connection pool.
+    Both responses have the header 'Retry-After'. Write quotas are checked
+    even if the limits of clients (RATE_LIMIT_ENABLED) are disabled.
+    """
+
+    def __init__(self, app: ASGIApp, limiter: RateLimiter) -> None:
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(LIMITED_PATH):
+            await self.app(scope, receive, send)
+            return
+
+        # Write quotas of tenants do not depend on the limits of clients
+        enabled = self.limiter.get_settings().enabled
+        wait = await self.limiter.check_rate(scope) if enabled else 0
+        if wait:
+            response = _rejection(429, "Too many requests", wait)
+            await response(scope, receive, send)
+            return
+        wait = await self.limiter.check_quota(scope)
+        if wait:
+            response = _rejection(429, "Tenant write quota exceeded", wait)
+            await response(scope, receive, send)
+            return
+
+        if not enabled:
+            await self.app(scope, receive, send)
+            return
+        if not await self.limiter.acquire():
+            response = _rejection(
+                503, "The service is overloaded", OVERLOAD_RETRY_AFTER
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release()
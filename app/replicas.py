@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+from itertools import count
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Replication lag of a PostgreSQL standby (seconds). The lag is 0 when the WAL
+# receiver is streaming and all received WAL has been replayed, so that an idle
+# primary does not look lagging. Without streaming (the standby has lost
+# the primary) the lag is the age of the last replayed transaction, and NULL
+# if no transaction has been replayed. The status of the receiver is visible
+# to roles with pg_read_all_stats (for example pg_monitor)
+REPLICATION_LAG_QUERY = text(
+    "SELECT CASE WHEN EXISTS ("
+    "SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming'"
+    ") AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class Replica:
+    """A read replica and its last known state."""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.lag = .0
+        self.checked_at = None
+        # A failed replica is not used until this time
+        self.failed_until = .0
+        # Held while the lag is being checked, so that it is checked by one thread
+        self.check_lock = threading.Lock()
+
+    def check_lag(self) -> float:
+        """Requests the replication lag of the replica (seconds). The lag of
+        a replica that is not streaming and has not replayed any transaction
+        is unknown and considered infinite.
+        """
+        if self.engine.dialect.name != "postgresql":
+            return .0
+        with self.engine.connect() as connection:
+            lag = connection.execute(REPLICATION_LAG_QUERY).scalar()
+        return float("inf") if lag is None else float(lag)
+
+
+class ReplicaRouter:
+    """Chooses a read replica for the next read in round-robin order.
+
+    Replicas that failed recently or lag behind the primary more than 'max_lag'
+    seconds are skipped. The lag of each replica is rechecked at most once per
+    'check_interval' seconds by one thread, other threads meanwhile use
+    the previous lag (a replica that has never been checked is skipped).
+    If no replica is available, None is returned and the read goes to the primary.
+    """
+
+    def __init__(
+        self, engines: list[Engine], max_lag: float,
+        check_interval: float, retry_interval: float
+    ):
+        self.replicas = [Replica(engine) for engine in engines]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_interval = retry_interval
+        self._counter = count()
+
+    def choose(self) -> Optional[Engine]:
+        """Returns the engine of an available replica or None."""
+        if not self.replicas:
+            return None
+        start = next(self._counter)
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            if self._is_available(replica):
+                return replica.engine
+        return None
+
+    def _needs_check(self, replica: Replica, now: float) -> bool:
+        return replica.checked_at is None or \
+            now - replica.checked_at >= self.check_interval
+
+    def _is_available(self, replica: Replica) -> bool:
+        now = time.monotonic()
+        if replica.failed_until > now:
+            return False
+        if self._needs_check(replica, now):
+            if replica.check_lock.acquire(blocking=False):
+                try:
+                    # Another thread may have checked the replica meanwhile
+                    if self._needs_check(replica, now):
+                        try:
+                            replica.lag = replica.check_lag()
+                        except Exception:
+                            logger.exception("Failed to check the replica %s",
+                                             replica.engine.url)
+                            self.mark_failed(replica.engine)
+                            return False
+                        finally:
+                            replica.checked_at = now
+                finally:
+                    replica.check_lock.release()
+            elif replica.checked_at is None:
+                return False
+        return replica.lag <= self.max_lag
+
+    def mark_failed(self, engine: Engine) -> None:
+        """Excludes the replica from reads for 'retry_interval' seconds."""
+        for replica in self.replicas:
+            if replica.engine is engine:
+                replica.failed_until = time.monotonic() + self.retry_interval
+
+    def dispose(self) -> None:
+        """Closes all connections to the replicas."""
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+    def metrics(self) -> dict:
+        """Returns the state of each replica."""
+        now = time.monotonic()
+        return {
+            replica.engine.url.render_as_string(hide_password=True): {
+                "lag": replica.lag,
+                "failed": replica.failed_until > now,
+            }
+            for replica in self.replicas
+        }
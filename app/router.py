@@ -1,26 +1,69 @@
+import asyncio
 from datetime import date
 
-from fastapi import APIRouter, Depends
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    Header,
+    Query,
+    Response,
+    HTTPException,
+    UploadFile,
+    WebSocket
+)
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
 from . import schemas
+from .schemas import IDEMPOTENCY_KEY_MAX_LENGTH
 from .crud import (
+    SORTABLE_FIELDS,
     delete_all_statistics,
+    get_running_statistics,
     get_statistics_for_date_period,
+    get_statistics_percentiles,
+    get_statistics_total,
+    get_top_statistics,
     summarize_or_create_statistics
 )
-from .database import get_db
-from .services import get_returns_statistics
+from .database import get_db, get_read_db, mark_write
+from .importer import detect_format, import_statistics, read_rows
+from .ingest import get_ingest_log, get_write_db
+from .live import get_broker
+from .metrics import collect_metrics
+from .services import (
+    get_columnar_statistics,
+    get_returns_percentiles,
+    get_returns_running_statistics,
+    get_returns_statistics,
+    get_returns_total
+)
+from .settings import get_tenant_settings
+from .singleflight import statistics_reads
+from .tenants import get_tenant, get_websocket_api_key, resolve_tenant
 
 router = APIRouter()
 
+RECORDS_FORMAT = "records"
+COLUMNAR_FORMAT = "columnar"
+# Media type of the 'Accept' header that selects the columnar format
+COLUMNAR_MEDIA_TYPE = "application/vnd.statistics.columnar+json"
+# Maximum size of a moving window (days)
+MAX_WINDOW = 366
+
 
 @router.get("/statistics")
 def get_statistics(
     date_from: date = None, date_to: date = None,
     sort_by: str = None, reverse_sort: bool = False,
-    db: Session = Depends(get_db)
+    response_format: str = Query(
+        None, alias="format", regex=f"^({RECORDS_FORMAT}|{COLUMNAR_FORMAT})$"
+    ),
+    accept: str = Header(None),
+    tenant_id: str = Depends(get_tenant),
+    db: Session = Depends(get_read_db)
 ):
     """Returns all statistics in the range from 'date_from' (inclusive) to
     'date_to' (inclusive).
@@ -32,17 +75,211 @@ def get_statistics(
     - If 'date_to' is not specified, then all statistics are shown starting from
       'date_from' (inclusive).
     - If both parameters are omitted, then all existing statistics are shown.
+
+    Statistics are read from a read replica if replicas are configured.
+
+    The parameter 'format=columnar' (or the header
+    'Accept: application/vnd.statistics.columnar+json') returns statistics
+    as arrays of values of each field instead of a dictionary by date.
+
+    Concurrent requests with the same parameters to the same database share
+    one query and its serialized response.
+    """
+    # Without the parameter 'format' the representation depends on 'Accept',
+    # so that shared caches have to store representations separately
+    headers = {"Vary": "Accept"} if response_format is None else None
+    if response_format is None and accept and COLUMNAR_MEDIA_TYPE in accept:
+        response_format = COLUMNAR_FORMAT
+    response_format = response_format or RECORDS_FORMAT
+
+    def read_statistics() -> bytes:
+        statistics = get_statistics_for_date_period(
+            db, date_from, date_to, tenant_id
+        )
+        statistics = get_returns_statistics(statistics, sort_by, reverse_sort)
+        if response_format == COLUMNAR_FORMAT:
+            statistics = get_columnar_statistics(statistics)
+        return JSONResponse(jsonable_encoder(statistics)).body
+
+    # The database is a part of the key, so that an error of a replica
+    # is not reported for requests that have been routed to another one
+    key = (
+        db.get_bind(), tenant_id,
+        date_from, date_to, sort_by, reverse_sort, response_format
+    )
+    return Response(
+        statistics_reads.do(key, read_statistics),
+        media_type="application/json", headers=headers,
+    )
+
+
+@router.get("/statistics/top")
+def get_top_statistics_handler(
+    sort_by: str = Query(..., regex=f"^({'|'.join(SORTABLE_FIELDS)})$"),
+    limit: int = Query(10, ge=1, le=1000), ascending: bool = False,
+    date_from: date = None, date_to: date = None,
+    tenant_id: str = Depends(get_tenant),
+    db: Session = Depends(get_read_db)
+):
+    """Returns 'limit' days of the range from 'date_from' (inclusive) to
+    'date_to' (inclusive) with the largest values of the field 'sort_by'
+    (views, clicks, cost, cpc or cpm) or with the smallest ones if 'ascending'.
+    Days without clicks (for cpc) or views (for cpm) are not included.
+    Statistics are returned in the same form as in GET /api/statistics.
     """
-    statistics = get_statistics_for_date_period(db, date_from, date_to)
-    return get_returns_statistics(statistics, sort_by, reverse_sort)
+    statistics = get_top_statistics(
+        db, sort_by, limit, ascending,
+        date_from=date_from, date_to=date_to, tenant_id=tenant_id
+    )
+    return get_returns_statistics(statistics, sort_by, reverse_sort=not ascending)
+
+
+@router.get("/statistics/percentiles")
+def get_statistics_percentiles_handler(
+    percentiles: list[float] = Query([.5]),
+    date_from: date = None, date_to: date = None,
+    tenant_id: str = Depends(get_tenant),
+    db: Session = Depends(get_read_db)
+):
+    """Returns percentiles (from 0 to 1, for example 0.5 is the median) of views,
+    clicks, cost, cpc and cpm over the range from 'date_from' (inclusive) to
+    'date_to' (inclusive). Several percentiles can be requested at once:
+    ?percentiles=0.5&percentiles=0.9
+    """
+    if any(not 0 <= percentile <= 1 for percentile in percentiles):
+        raise HTTPException(
+            status_code=422, detail="Percentiles must be between 0 and 1"
+        )
+    values = get_statistics_percentiles(
+        db, percentiles, date_from=date_from, date_to=date_to, tenant_id=tenant_id
+    )
+    return get_returns_percentiles(percentiles, values)
+
+
+@router.get("/statistics/running")
+def get_running_statistics_handler(
+    windows: list[int] = Query([7, 30]),
+    date_from: date = None, date_to: date = None,
+    tenant_id: str = Depends(get_tenant),
+    db: Session = Depends(get_read_db)
+):
+    """Returns statistics in the range from 'date_from' (inclusive) to 'date_to'
+    (inclusive) with cumulative totals since the first statistics and totals
+    over moving windows of 'windows' days ending on each date (by default 7 and
+    30 days), together with their cpc and cpm. Several windows can be requested
+    at once: ?windows=7&windows=30
+    """
+    if any(not 1 <= window <= MAX_WINDOW for window in windows):
+        raise HTTPException(
+            status_code=422, detail=f"Windows must be between 1 and {MAX_WINDOW} days"
+        )
+    rows = get_running_statistics(
+        db, windows, date_from=date_from, date_to=date_to, tenant_id=tenant_id
+    )
+    return get_returns_running_statistics(rows, windows)
+
+
+@router.get("/statistics/total")
+def get_statistics_total_handler(
+    date_from: date = None, date_to: date = None,
+    tenant_id: str = Depends(get_tenant),
+    db: Session = Depends(get_read_db)
+):
+    """Returns the total views, clicks and cost with their cpc and cpm
+    in the range from 'date_from' (inclusive) to 'date_to' (inclusive).
+    """
+    return get_returns_total(
+        *get_statistics_total(
+            db, date_from=date_from, date_to=date_to, tenant_id=tenant_id
+        )
+    )
+
+
+@router.websocket("/statistics/live")
+async def statistics_live(
+    websocket: WebSocket, date_from: date = None, date_to: date = None
+):
+    """Sends changes of statistics in the range from 'date_from' (inclusive) to
+    'date_to' (inclusive) as they are saved. Messages have the form:
+
+    - {"type": "delta", "statistics": {...}} - current statistics of the changed
+      dates in the same form as in GET /api/statistics
+    - {"type": "resync"} - statistics have changed too much (or the client has not
+      kept up with the changes), they should be re-read with GET /api/statistics
+
+    Only changes of the tenant of the API key are sent, a connection with
+    an unknown key is closed with the code 1008. Besides the header, the key
+    can be entered in the subprotocol 'api-key.<key>' or in the query parameter
+    'api_key' (browsers cannot set headers of WebSocket connections).
+    """
+    settings = get_tenant_settings()
+    api_key, subprotocol = get_websocket_api_key(websocket, settings)
+    await websocket.accept(subprotocol=subprotocol)
+    tenant_id = resolve_tenant(api_key, settings)
+    if tenant_id is None:
+        await websocket.close(code=1008)
+        return
+    broker = get_broker()
+    if broker is None:
+        await websocket.close(code=1013)
+        return
+
+    subscription = broker.subscribe(date_from, date_to, tenant_id)
+    disconnected = asyncio.ensure_future(_wait_disconnect(websocket))
+    try:
+        while True:
+            message = asyncio.ensure_future(subscription.get())
+            await asyncio.wait(
+                {message, disconnected}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if disconnected.done():
+                message.cancel()
+                break
+            await websocket.send_json(message.result())
+    finally:
+        broker.unsubscribe(subscription)
+        disconnected.cancel()
+
+
+async def _wait_disconnect(websocket: WebSocket) -> None:
+    """Waits until the client closes the connection (incoming messages are ignored)."""
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
 
 
 @router.post("/statistics")
-def save_statistics(statistics: schemas.Statistics, db: Session = Depends(get_db)):
+def save_statistics(
+    statistics: schemas.StatisticsEvent,
+    idempotency_key: str = Header(
+        None, min_length=1, max_length=IDEMPOTENCY_KEY_MAX_LENGTH
+    ),
+    tenant_id: str = Depends(get_tenant),
+    db: Session = Depends(get_write_db)
+):
     """Processes the saving of new statistics to the database.
     If there are statistics for the entered date, the statistics will be summarized.
+
+    An idempotency key can be entered in the event field 'idempotency_key' or
+    in the 'Idempotency-Key' header (the field takes precedence). An event with
+    an already applied key is not summarized again.
+
+    If the ingest log is enabled, the event is saved to the log and applied
+    to the database in the background (the response has the status 202),
+    also while the database is unavailable.
     """
-    statistics, created = summarize_or_create_statistics(db, statistics)
+    statistics.idempotency_key = statistics.idempotency_key or idempotency_key
+
+    ingest_log = get_ingest_log()
+    if ingest_log is not None:
+        ingest_log.append(statistics, tenant_id)
+        response = JSONResponse(status_code=202, content={"accepted": True})
+        mark_write(response)
+        return response
+
+    statistics, created = summarize_or_create_statistics(
+        db, statistics, idempotency_key=statistics.idempotency_key,
+        tenant_id=tenant_id,
+    )
     content = {
         "statistics": {
             "date": str(statistics.date),
@@ -53,11 +290,45 @@ def save_statistics(statistics: schemas.Statistics, db: Session = Depends(get_db
         "created": created,
         "aggregated": not created,
     }
-    return JSONResponse(status_code=201, content=content)
+    response = JSONResponse(status_code=201, content=content)
+    mark_write(response)
+    return response
+
+
+@router.post("/statistics/import", response_model=schemas.ImportReport)
+def import_statistics_file(
+    response: Response,
+    file: UploadFile = File(...),
+    file_format: str = Query(None, alias="format", regex="^(csv|parquet)$"),
+    tenant_id: str = Depends(get_tenant),
+    db: Session = Depends(get_db)
+):
+    """Imports statistics from a CSV file with the header 'date,views,clicks,cost'
+    or from a Parquet file with the same columns. The format is determined by
+    the file extension unless the parameter 'format' is entered.
+
+    Rows are validated like in the saving of statistics, rows with the same date
+    are summarized. Invalid rows are rejected and returned with their numbers.
+    """
+    rows = read_rows(file.file, file_format or detect_format(file.filename))
+    report = import_statistics(db, rows, tenant_id=tenant_id)
+    mark_write(response)
+    return report
 
 
 @router.delete("/statistics")
-def reset_statistics(db: Session = Depends(get_db)):
-    """Deletes all saved statistics."""
-    delete_all_statistics(db)
+def reset_statistics(
+    response: Response,
+    tenant_id: str = Depends(get_tenant),
+    db: Session = Depends(get_db)
+):
+    """Deletes all saved statistics of the tenant."""
+    delete_all_statistics(db, tenant_id)
+    mark_write(response)
     return {"message": "Deleted", "error": 0}
+
+
+@router.get("/metrics")
+def get_metrics():
+    """Returns the service metrics (for example, the state of the ingest log)."""
+    return collect_metrics()
@@ -1,8 +1,11 @@
 import datetime
+from typing import Optional
 
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, constr, validator
 from pydantic.types import NonNegativeInt, NonNegativeFloat
 
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+
 
 class Statistics(BaseModel):
     date: datetime.date
@@ -16,3 +19,27 @@ class Statistics(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class StatisticsEvent(Statistics):
+    """Statistics sent by a tracker. The optional 'idempotency_key' allows
+    the tracker to safely retry sending the same event.
+    """
+    idempotency_key: Optional[
+        constr(min_length=1, max_length=IDEMPOTENCY_KEY_MAX_LENGTH)
+    ] = None
+
+
+class RejectedRow(BaseModel):
+    row: int
+    error: str
+
+
+class ImportReport(BaseModel):
+    """Result of a bulk import of statistics."""
+    imported: int
+    rejected_count: int
+    # Details of the first rejected rows
+    rejected: list[RejectedRow]
+    seconds: float
+    rows_per_second: float
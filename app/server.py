@@ -0,0 +1,28 @@
+"""Production entry point: python -m app.server
+
+Runs several uvicorn worker processes with uvloop and httptools. Each worker
+imports the application separately and creates its own database engine
+on startup (see app.main).
+"""
+import uvicorn
+
+from .settings import get_server_settings
+
+
+def main() -> None:
+    settings = get_server_settings()
+    uvicorn.run(
+        "app.main:app",
+        host=settings.host,
+        port=settings.port,
+        workers=settings.workers,
+        loop="uvloop",
+        http="httptools",
+        proxy_headers=True,
+        timeout_keep_alive=settings.timeout_keep_alive,
+        log_level=settings.log_level,
+    )
+
+
+if __name__ == "__main__":
+    main()
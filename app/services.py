@@ -2,6 +2,9 @@ from typing import Optional
 
 from . import models, schemas
 
+# Fields of statistics in the output form
+STATISTICS_FIELDS = ("date", "views", "clicks", "cost", "cpc", "cpm")
+
 
 def _get_cpc(cost: float, clicks: int) -> Optional[float]:
     """Returns the average cost per click."""
@@ -17,6 +20,37 @@ def _get_cpm(cost: float, views: int) -> Optional[float]:
     return round(cost / views * 1000, 2)
 
 
+def percentile_cont(values: list[float], percentile: float) -> Optional[float]:
+    """Returns the percentile (from 0 to 1) of sorted values with linear
+    interpolation between the closest values (like percentile_cont in PostgreSQL)
+    or None if there are no values.
+    """
+    if not values:
+        return None
+    position = percentile * (len(values) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def get_returns_percentiles(
+    percentiles: list[float], values: dict[str, list[Optional[float]]]
+) -> dict:
+    """Returns percentiles of metrics in the form of a dictionary (example):
+    {
+        'views': {'0.5': 1000.0, '0.9': 2000.0},
+        'cpc': {'0.5': 0.2, '0.9': None}
+    }
+    """
+    return {
+        metric: {
+            str(percentile): round(value, 2) if value is not None else None
+            for percentile, value in zip(percentiles, metric_values)
+        }
+        for metric, metric_values in values.items()
+    }
+
+
 def get_returns_statistics(
     statistics: list[models.Statistics], sort_by: str = None, reverse_sort: bool = False
 ) -> dict:
@@ -48,7 +82,81 @@ def get_returns_statistics(
             key=lambda x: x[0], reverse=reverse_sort
         ))
 
-    return dict(sorted(
-        reformed_statistics.items(),
-        key=lambda x: x[1][sort_by], reverse=reverse_sort
-    ))
+    # Days where cpc or cpm is not defined are placed last in date order
+    defined = [x for x in reformed_statistics.items() if x[1][sort_by] is not None]
+    undefined = [x for x in reformed_statistics.items() if x[1][sort_by] is None]
+    defined.sort(key=lambda x: x[1][sort_by], reverse=reverse_sort)
+    undefined.sort(key=lambda x: x[0])
+    return dict(defined + undefined)
+
+
+def get_columnar_statistics(statistics: dict) -> dict:
+    """Returns statistics in the form returned by get_returns_statistics as
+    a dictionary of arrays of field values in the same order (example):
+    {
+        'date': ['2000-01-01', '2000-01-02'],
+        'views': [1000, 2000],
+        'clicks': [2500, 100],
+        'cost': [500.0, 20.0],
+        'cpc': [0.2, 0.2],
+        'cpm': [500.0, 10.0]
+    }
+    """
+    columns = {field: [] for field in STATISTICS_FIELDS}
+    for row in statistics.values():
+        for field, values in columns.items():
+            values.append(row[field])
+    return columns
+
+
+def get_returns_total(views: int, clicks: int, cost: float) -> dict:
+    """Returns summed statistics with their cpc and cpm in the form (example):
+    {'views': 1000, 'clicks': 2500, 'cost': 500.0, 'cpc': 0.2, 'cpm': 500.0}
+    """
+    cost = round(cost, 2)
+    return {
+        "views": views,
+        "clicks": clicks,
+        "cost": cost,
+        "cpc": _get_cpc(cost, clicks),
+        "cpm": _get_cpm(cost, views),
+    }
+
+
+def get_returns_running_statistics(rows: list, windows: list[int]) -> dict:
+    """Returns statistics with cumulative sums and sums over moving windows
+    (rows of crud.get_running_statistics) in the form (example):
+    {
+        '2000-01-07': {
+            'date': '2000-01-07',
+            'views': 1000,
+            'clicks': 2500,
+            'cost': 500.0,
+            'cumulative': {'views': 7000, 'clicks': 9000, ..., 'cpm': 300.0},
+            'moving': {
+                '7': {'views': 7000, 'clicks': 9000, ..., 'cpm': 300.0}
+            }
+        }
+    }
+    The cpc and cpm of a window are the cost of the window divided by
+    the clicks (views) of the window.
+    """
+    running_statistics = dict()
+    for row in rows:
+        running_statistics[row.date] = {
+            "date": row.date,
+            "views": row.views,
+            "clicks": row.clicks,
+            "cost": row.cost,
+            "cumulative": get_returns_total(
+                row.cumulative_views, row.cumulative_clicks, row.cumulative_cost
+            ),
+            "moving": {
+                str(window): get_returns_total(*[
+                    getattr(row, f"moving_{window}_{field}")
+                    for field in ("views", "clicks", "cost")
+                ])
+                for window in windows
+            },
+        }
+    return running_statistics
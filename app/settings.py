@@ -1,6 +1,9 @@
+import os
+import re
 from functools import lru_cache
+from typing import Optional
 
-from pydantic import BaseSettings
+from pydantic import BaseSettings, validator
 
 
 class DatabaseSettings(BaseSettings):
@@ -10,13 +13,226 @@ class DatabaseSettings(BaseSettings):
     host: str
     port: str
     database: str
+    # Connection pool of each worker process
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30
+    pool_recycle: int = 30 * 60
+    # Read replicas (JSON list of database URLs) and routing of reads to them
+    replica_urls: list[str] = []
+    # Maximum replication lag of a replica used for reads (seconds)
+    replica_max_lag: float = 5
+    # Interval between checks of the replication lag (seconds)
+    replica_check_interval: float = 5
+    # Time during which a failed replica is not used (seconds)
+    replica_retry_interval: float = 30
 
     class Config:
         env_prefix = "DB_"
         env_file = ".env"
 
 
+class IdempotencySettings(BaseSettings):
+    # Lifetime of a stored idempotency key (seconds)
+    ttl: int = 24 * 60 * 60
+    # Upper bound of the number of stored keys
+    max_keys: int = 1_000_000
+    # Interval between bulk purges of expired keys (seconds)
+    purge_interval: int = 5 * 60
+
+    class Config:
+        env_prefix = "IDEMPOTENCY_"
+        env_file = ".env"
+
+
+class IngestSettings(BaseSettings):
+    # If enabled, events are saved to the local log and applied in the background
+    enabled: bool = False
+    # Directory of the log (each worker process uses its own subdirectory)
+    directory: str = "ingest"
+    # Maximum size of a segment file (bytes)
+    segment_size: int = 64 * 1024 * 1024
+    # Maximum number of events applied to the database in one transaction
+    batch_size: int = 5000
+    # Pause of the consumer when the log is empty or the database fails (seconds)
+    poll_interval: float = 0.5
+
+    class Config:
+        env_prefix = "INGEST_"
+        env_file = ".env"
+
+
+class ServerSettings(BaseSettings):
+    host: str = "0.0.0.0"
+    port: int = 8000
+    workers: int = os.cpu_count() or 1
+    # Seconds to keep idle HTTP connections open
+    timeout_keep_alive: int = 5
+    log_level: str = "info"
+
+    class Config:
+        env_prefix = "SERVER_"
+        env_file = ".env"
+
+
+class LiveSettings(BaseSettings):
+    # Interval of delivery of coalesced changes to subscribers (seconds)
+    tick: float = 0.5
+    # Maximum number of undelivered messages of a subscriber
+    max_pending: int = 100
+
+    class Config:
+        env_prefix = "LIVE_"
+        env_file = ".env"
+
+
+class CompressionSettings(BaseSettings):
+    # Responses smaller than this size (bytes) are not compressed
+    minimum_size: int = 1000
+    gzip_level: int = 6
+    brotli_quality: int = 4
+
+    class Config:
+        env_prefix = "COMPRESSION_"
+        env_file = ".env"
+
+
+class RateLimitSettings(BaseSettings):
+    # Disabled by default: behind a proxy that is not trusted by the server
+    # (FORWARDED_ALLOW_IPS) all clients without a key share one IP address
+    enabled: bool = False
+    # Sustained rate (requests per second) and burst of each client on each route
+    read_rate: float = 100
+    read_burst: int = 200
+    write_rate: float = 100
+    write_burst: int = 200
+    # Limits of particular routes, for example {"POST /api/statistics": [10, 20]}
+    routes: dict[str, tuple[float, int]] = {}
+    # Clients are identified by this header or by the IP address without it
+    api_key_header: str = "X-API-Key"
+    # Requests handled at once by a worker (by default the size of the pool
+    # DB_POOL_SIZE + DB_MAX_OVERFLOW) and the time a request waits for a free slot
+    max_concurrent: Optional[int] = None
+    queue_timeout: float = 1
+
+    class Config:
+        env_prefix = "RATE_LIMIT_"
+        env_file = ".env"
+
+
+class TotalsSettings(BaseSettings):
+    # Maintain prefix sums of statistics on writes (rebuild them after enabling)
+    enabled: bool = False
+
+    class Config:
+        env_prefix = "TOTALS_"
+        env_file = ".env"
+
+
+class HealthSettings(BaseSettings):
+    # Consecutive failed (or slower than 'slow_query' seconds) queries after
+    # which requests to the database fail fast for 'reset_timeout' seconds
+    failure_threshold: int = 5
+    slow_query: float = 5
+    reset_timeout: float = 10
+    # Readiness: the database ping is cached for 'ping_interval' seconds,
+    # the worker is not ready if the ping takes more than 'max_ping' seconds
+    ping_interval: float = 1
+    max_ping: float = 1
+
+    class Config:
+        env_prefix = "HEALTH_"
+        env_file = ".env"
+
+
+# Tenant ids are used in names of partitions, so that they are restricted
+TENANT_ID_PATTERN = re.compile(r"^[a-z0-9_]{1,40}$")
+
+
+class TenantSettings(BaseSettings):
+    # Tenants by API keys (JSON), for example {"key-of-team-a": "team_a"}.
+    # If no keys are configured, all requests belong to the tenant 'default'
+    api_keys: dict[str, str] = {}
+    api_key_header: str = "X-API-Key"
+    # If enabled, requests without an API key belong to the tenant 'default'
+    # even if API keys are configured, otherwise they are rejected
+    allow_anonymous: bool = False
+    # Write quota of each tenant: requests per second and burst (0 - unlimited),
+    # and quotas of particular tenants, for example {"team_a": [100, 200]}
+    write_rate: float = 0
+    write_burst: int = 0
+    quotas: dict[str, tuple[float, int]] = {}
+
+    @validator("api_keys")
+    def check_tenant_ids(cls, v):
+        for tenant_id in v.values():
+            if not TENANT_ID_PATTERN.match(tenant_id):
+                raise ValueError(
+                    f"Tenant id '{tenant_id}' must consist of 1-40 lowercase "
+                    f"letters, digits and underscores"
+                )
+        return v
+
+    class Config:
+        env_prefix = "TENANT_"
+        env_file = ".env"
+
+
 @lru_cache
 def get_db_settings() -> DatabaseSettings:
     """Returns the database configuration object from the environment file."""
     return DatabaseSettings()
+
+
+@lru_cache
+def get_idempotency_settings() -> IdempotencySettings:
+    """Returns the idempotency keys configuration object from the environment file."""
+    return IdempotencySettings()
+
+
+@lru_cache
+def get_ingest_settings() -> IngestSettings:
+    """Returns the ingest log configuration object from the environment file."""
+    return IngestSettings()
+
+
+@lru_cache
+def get_server_settings() -> ServerSettings:
+    """Returns the production server configuration object from the environment file."""
+    return ServerSettings()
+
+
+@lru_cache
+def get_live_settings() -> LiveSettings:
+    """Returns the live feed configuration object from the environment file."""
+    return LiveSettings()
+
+
+@lru_cache
+def get_compression_settings() -> CompressionSettings:
+    """Returns the compression configuration object from the environment file."""
+    return CompressionSettings()
+
+
+@lru_cache
+def get_rate_limit_settings() -> RateLimitSettings:
+    """Returns the rate limits configuration object from the environment file."""
+    return RateLimitSettings()
+
+
+@lru_cache
+def get_totals_settings() -> TotalsSettings:
+    """Returns the prefix sums configuration object from the environment file."""
+    return TotalsSettings()
+
+
+@lru_cache
+def get_health_settings() -> HealthSettings:
+    """Returns the health checks configuration object from the environment file."""
+    return HealthSettings()
+
+
+@lru_cache
+def get_tenant_settings() -> TenantSettings:
+    """Returns the tenants configuration object from the environment file."""
+    return TenantSettings()
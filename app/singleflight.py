@@ -0,0 +1,75 @@
+import threading
+from typing import Callable, Hashable, TypeVar
+
+from .exceptions import CoalescedFailureException
+
+T = TypeVar("T")
+
+
+class _Call:
+    """A computation in flight and its outcome."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Deduplicates concurrent computations with the same key in the current process.
+
+    The first caller with a key runs the function, callers that arrive with the
+    same key while it runs wait for it and receive the same result. If the
+    function fails, its exception is raised in the first caller and the waiting
+    callers receive CoalescedFailureException caused by it, so that the failure
+    is counted once. The result is not cached: a call after the computation has
+    finished runs the function again. Safe to call from the threads of the pool
+    that runs synchronous handlers.
+    """
+
+    def __init__(self):
+        self.executions = 0
+        self.coalesced = 0
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable[[], T]) -> T:
+        """Returns the result of the function, sharing it between concurrent
+        calls with the same key.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise CoalescedFailureException(call.error) from call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def metrics(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+        }
+
+
+# Reads of statistics of the current process
+statistics_reads = SingleFlight()
@@ -0,0 +1,39 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from starlette.concurrency import run_in_threadpool
+
+from .crud import delete_expired_idempotency_keys
+from .database import create_session
+from .settings import get_idempotency_settings
+
+logger = logging.getLogger(__name__)
+
+
+def purge_idempotency_keys() -> int:
+    """Deletes expired idempotency keys and returns the number of deleted keys."""
+    settings = get_idempotency_settings()
+    db = create_session()
+    try:
+        return delete_expired_idempotency_keys(
+            db,
+            expired_before=datetime.utcnow() - timedelta(seconds=settings.ttl),
+            max_keys=settings.max_keys,
+        )
+    finally:
+        db.close()
+
+
+async def purge_idempotency_keys_periodically() -> None:
+    """Purges expired idempotency keys in the background every
+    'purge_interval' seconds until the task is cancelled.
+    """
+    settings = get_idempotency_settings()
+    while True:
+        await asyncio.sleep(settings.purge_interval)
+        try:
+            deleted = await run_in_threadpool(purge_idempotency_keys)
+            logger.info("Purged %d expired idempotency keys", deleted)
+        except Exception:
+            logger.exception("Failed to purge expired idempotency keys")
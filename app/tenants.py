@@ -0,0 +1,65 @@
+from typing import Optional
+
+from fastapi import HTTPException
+from starlette.requests import HTTPConnection
+from starlette.websockets import WebSocket
+
+from .settings import TenantSettings, get_tenant_settings
+
+# Tenant of requests without an API key
+DEFAULT_TENANT = "default"
+TENANT_ID_MAX_LENGTH = 40
+# Browser WebSocket clients cannot set headers, so that they enter the API key
+# in the subprotocol 'api-key.<key>' or in the query parameter 'api_key'
+API_KEY_SUBPROTOCOL_PREFIX = "api-key."
+API_KEY_QUERY_PARAM = "api_key"
+
+
+def resolve_tenant(
+    api_key: Optional[str], settings: TenantSettings = None
+) -> Optional[str]:
+    """Returns the tenant of the API key or None if the key is unknown.
+    All requests belong to the default tenant if no API keys are configured
+    (keys are then used only by rate limits). Requests without a key belong
+    to the default tenant if anonymous access is allowed, otherwise None
+    is returned.
+    """
+    settings = settings or get_tenant_settings()
+    if not settings.api_keys:
+        return DEFAULT_TENANT
+    if not api_key:
+        return DEFAULT_TENANT if settings.allow_anonymous else None
+    return settings.api_keys.get(api_key)
+
+
+def get_tenant(connection: HTTPConnection) -> str:
+    """Returns the tenant of the request by its API key or raises
+    HTTPException 401 if the key is unknown or required but not entered.
+    """
+    settings = get_tenant_settings()
+    api_key = connection.headers.get(settings.api_key_header)
+    tenant_id = resolve_tenant(api_key, settings)
+    if tenant_id is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Unknown API key" if api_key else "API key required",
+        )
+    return tenant_id
+
+
+def get_websocket_api_key(
+    websocket: WebSocket, settings: TenantSettings = None
+) -> tuple[Optional[str], Optional[str]]:
+    """Returns the API key of the WebSocket connection from the header,
+    the subprotocol or the query parameter and the subprotocol to be accepted
+    (browsers close connections that do not accept any of the offered ones).
+    """
+    settings = settings or get_tenant_settings()
+    subprotocol = next((
+        subprotocol for subprotocol in websocket.scope.get("subprotocols", [])
+        if subprotocol.startswith(API_KEY_SUBPROTOCOL_PREFIX)
+    ), None)
+    api_key = websocket.headers.get(settings.api_key_header) or \
+        (subprotocol and subprotocol[len(API_KEY_SUBPROTOCOL_PREFIX):]) or \
+        websocket.query_params.get(API_KEY_QUERY_PARAM)
+    return api_key, subprotocol
@@ -0,0 +1,71 @@
+"""Benchmark of GET /api/statistics: bytes on the wire and latency of large
+ranges in the records and columnar formats with and without compression.
+
+Usage: python -m benchmarks.response_size [--years 10] [--repeat 20]
+"""
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app import compression
+from app.database import Base, dispose_engine
+from app.generator import generate_statistics
+from app.importer import import_statistics
+from app.main import create_app
+
+FORMATS = ("records", "columnar")
+ENCODINGS = ("identity", "gzip", "br")
+
+
+def fill_database(engine, years: int) -> None:
+    """Saves synthetic daily statistics for the number of years."""
+    db = Session(bind=engine)
+    import_statistics(db, generate_statistics(years, seed=0))
+    db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(
+            f"sqlite:///{Path(directory) / 'benchmark.db'}",
+            connect_args={"check_same_thread": False},
+        )
+        Base.metadata.create_all(bind=engine)
+        fill_database(engine, args.years)
+
+        print(f"GET /api/statistics, {args.years * 365} days, "
+              f"median of {args.repeat} requests")
+        print(f"{'format':<10}{'encoding':<10}{'bytes':>10}{'latency, ms':>14}")
+        with TestClient(create_app(engine=engine)) as client:
+            for response_format in FORMATS:
+                for encoding in ENCODINGS:
+                    if encoding == "br" and compression.brotli is None:
+                        continue
+                    latencies = []
+                    for _ in range(args.repeat):
+                        started = time.perf_counter()
+                        response = client.get(
+                            f"/api/statistics?format={response_format}",
+                            headers={"Accept-Encoding": encoding},
+                        )
+                        latencies.append(time.perf_counter() - started)
+                    size = int(response.headers["Content-Length"])
+                    latency = statistics.median(latencies) * 1000
+                    print(f"{response_format:<10}{encoding:<10}{size:>10}"
+                          f"{latency:>14.1f}")
+        dispose_engine()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,28 @@ import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session, sessionmaker
 
-from app.database import Base, get_db
+from app.database import Base, get_db, get_read_db
+from app.generator import generate_statistics
+from app.importer import import_statistics
+from app.ingest import get_write_db
 from app.main import app
 
 
+def pytest_addoption(parser) -> None:
+    parser.addoption(
+        "--scale-years", type=float, default=10,
+        help="years of statistics generated for scale tests (default 10)",
+    )
+
+
+def pytest_configure(config) -> None:
+    config.addinivalue_line(
+        "markers",
+        "scale: tests on realistic volumes of statistics with time and memory "
+        "budgets (deselect with '-m \"not scale\"')",
+    )
+
+
 @pytest.fixture()
 def db():
     """Returns the session object for testing.
@@ -53,7 +71,51 @@ def db_handlers():
             yield db
         finally:
             db.close()
-            if Path(database_file).exists():
-                os.remove(database_file)
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    app.dependency_overrides[get_write_db] = override_get_db
+
+    try:
+        yield
+    finally:
+        app.dependency_overrides.clear()
+        engine.dispose()
+        if Path(database_file).exists():
+            os.remove(database_file)
+
+
+@pytest.fixture()
+def generated_db(request, tmp_path) -> Session:
+    """Returns the session object of a database with generated statistics of
+    '--scale-years' years. Handlers use the same database.
+    """
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'generated.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    db = TestingSessionLocal()
+    import_statistics(
+        db, generate_statistics(request.config.getoption("--scale-years"), seed=0)
+    )
+
+    def override_get_db():
+        try:
+            session = TestingSessionLocal()
+            yield session
+        finally:
+            session.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    app.dependency_overrides[get_write_db] = override_get_db
+
+    try:
+        yield db
+    finally:
+        app.dependency_overrides.clear()
+        db.close()
+        engine.dispose()
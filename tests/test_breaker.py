@@ -0,0 +1,74 @@
+import pytest
+
+from app import breaker as breaker_module
+from app.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+RESET_TIMEOUT = 10
+
+
+@pytest.fixture()
+def now(monkeypatch) -> list[float]:
+    """Returns the mutable current time of the circuit breaker."""
+    current = [100.0]
+    monkeypatch.setattr(breaker_module.time, "monotonic", lambda: current[0])
+    return current
+
+
+@pytest.fixture()
+def circuit_breaker(now) -> CircuitBreaker:
+    """Returns a circuit breaker that opens after 3 failures."""
+    return CircuitBreaker(
+        failure_threshold=3, latency_threshold=1, reset_timeout=RESET_TIMEOUT
+    )
+
+
+def test_opens_on_consecutive_failures(circuit_breaker: CircuitBreaker) -> None:
+    """Testing that the circuit opens after consecutive failures only
+    and that slow queries count as failures.
+    """
+    circuit_breaker.record_failure()
+    circuit_breaker.record_failure()
+    circuit_breaker.record_success(.1)
+    assert circuit_breaker.metrics()["consecutive_failures"] == 0
+
+    circuit_breaker.record_failure()
+    circuit_breaker.record_success(5)
+    assert circuit_breaker.allow()
+    circuit_breaker.record_failure()
+    assert circuit_breaker.state == OPEN
+    assert not circuit_breaker.allow()
+    assert circuit_breaker.retry_after() == RESET_TIMEOUT
+    assert circuit_breaker.metrics() == {
+        "state": OPEN, "consecutive_failures": 3, "opened": 1, "rejected": 1
+    }
+
+
+@pytest.mark.parametrize("probe_succeeds", [True, False])
+def test_half_open_probe(
+    circuit_breaker: CircuitBreaker, now: list[float], probe_succeeds: bool
+) -> None:
+    """Testing that one probe is let through after the reset timeout and
+    that its result closes or reopens the circuit.
+    """
+    for _ in range(3):
+        circuit_breaker.record_failure()
+    circuit_breaker.record_success(.1)
+    assert circuit_breaker.state == OPEN
+    now[0] += RESET_TIMEOUT
+    assert circuit_breaker.admit() == HALF_OPEN
+    assert circuit_breaker.state == HALF_OPEN
+    assert not circuit_breaker.allow()
+
+    if probe_succeeds:
+        # Successful queries do not close the circuit until the probe completes
+        circuit_breaker.record_success(.1)
+        assert circuit_breaker.state == HALF_OPEN
+        circuit_breaker.record_probe_success()
+        assert circuit_breaker.state == CLOSED
+        assert circuit_breaker.allow()
+    else:
+        circuit_breaker.record_failure()
+        assert circuit_breaker.state == OPEN
+        assert not circuit_breaker.allow()
+        now[0] += RESET_TIMEOUT
+        assert circuit_breaker.allow()
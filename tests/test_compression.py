@@ -0,0 +1,77 @@
+import gzip
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+
+from app import compression
+from app.compression import CompressionMiddleware, get_accepted_encodings
+from app.settings import CompressionSettings
+
+MINIMUM_SIZE = 100
+
+
+@pytest.fixture()
+def client() -> TestClient:
+    """Returns a client of an application with compressed responses."""
+    app = FastAPI()
+    app.add_middleware(
+        CompressionMiddleware, settings=CompressionSettings(minimum_size=MINIMUM_SIZE)
+    )
+
+    @app.get("/text")
+    def text(size: int):
+        return PlainTextResponse("x" * size)
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, encodings",
+    [
+        ("", set()),
+        ("gzip, deflate", {"gzip", "deflate"}),
+        ("br;q=1.0, gzip;q=0.5, *;q=0", {"br", "gzip"}),
+        ("gzip;q=0, br", {"br"}),
+    ]
+)
+def test_accepted_encodings(accept_encoding: str, encodings: set[str]) -> None:
+    """Testing parsing of the 'Accept-Encoding' header."""
+    assert get_accepted_encodings(accept_encoding) == encodings
+
+
+def test_gzip_compression(client: TestClient, monkeypatch) -> None:
+    """Testing that large responses are compressed with gzip and small are not."""
+    monkeypatch.setattr(compression, "brotli", None)
+    headers = {"Accept-Encoding": "gzip, br"}
+
+    response = client.get(f"/text?size={MINIMUM_SIZE * 10}", headers=headers)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert int(response.headers["Content-Length"]) == len(
+        gzip.compress(b"x" * MINIMUM_SIZE * 10, compresslevel=6, mtime=0)
+    )
+    assert response.content == b"x" * MINIMUM_SIZE * 10
+
+    response = client.get(f"/text?size={MINIMUM_SIZE // 2}", headers=headers)
+    assert "Content-Encoding" not in response.headers
+
+
+def test_brotli_compression(client: TestClient) -> None:
+    """Testing that responses are compressed with brotli if it is accepted."""
+    pytest.importorskip("brotli")
+    response = client.get(
+        f"/text?size={MINIMUM_SIZE * 10}", headers={"Accept-Encoding": "gzip, br"}
+    )
+    assert response.headers["Content-Encoding"] == "br"
+    assert int(response.headers["Content-Length"]) < MINIMUM_SIZE
+    assert response.content == b"x" * MINIMUM_SIZE * 10
+
+
+def test_no_compression(client: TestClient) -> None:
+    """Testing that responses are not compressed without 'Accept-Encoding'."""
+    response = client.get(
+        f"/text?size={MINIMUM_SIZE * 10}", headers={"Accept-Encoding": "identity"}
+    )
+    assert "Content-Encoding" not in response.headers
+    assert response.text == "x" * MINIMUM_SIZE * 10
@@ -1,16 +1,21 @@
 import datetime
+from datetime import timedelta
 
 import pytest
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
 
-from app import models, schemas
+from app import crud, importer, models, schemas
 from app.crud import (
-    create_statistics, delete_all_statistics,
-    get_statistics_for_date, get_statistics_for_date_period,
-    summarize_or_create_statistics, summarize_statistics
+    create_statistics, delete_all_statistics, delete_expired_idempotency_keys,
+    get_running_statistics, get_statistics_for_date, get_statistics_for_date_period,
+    get_statistics_percentiles, get_statistics_total, get_top_statistics,
+    is_idempotency_key_used, refresh_statistics_totals,
+    summarize_or_create_statistics, summarize_statistics, summarize_statistics_batch
 )
-from app.exceptions import UniqueViolationException
+from app.exceptions import DuplicateEventException, UniqueViolationException
+from app.importer import import_statistics
+from app.settings import TotalsSettings
 
 STATISTICS_LIST_LEN = 3
 VIEWS_COUNT = 100
@@ -45,7 +50,8 @@ def test_create_new_statistics(
     )
     statistics = create_statistics(db, statistics=statistics_in)
     assert statistics
-    assert jsonable_encoder(statistics) == jsonable_encoder(statistics_in)
+    assert jsonable_encoder(schemas.Statistics.from_orm(statistics)) == \
+        jsonable_encoder(statistics_in)
     assert db.query(models.Statistics).count() == 1
     assert db.query(models.Statistics).first() == statistics
 
@@ -283,5 +289,221 @@ def test_summarize_or_create_statistics_data_not_exists(
 
     statistics, created = summarize_or_create_statistics(db, new_statistics)
     assert created
-    assert jsonable_encoder(models.Statistics(**new_statistics.dict())) == \
-           jsonable_encoder(statistics)
+    assert jsonable_encoder(new_statistics) == \
+           jsonable_encoder(schemas.Statistics.from_orm(statistics))
+
+
+@pytest.mark.parametrize(
+    "date, val, key",
+    [(datetime.date(2000, 1, 1), 100, "event-1")]
+)
+def test_summarize_or_create_statistics_with_idempotency_key(
+    db: Session, date: datetime.date, val: int, key: str
+) -> None:
+    """Test that a repeated event with the same idempotency key is not summarized."""
+    new_statistics = schemas.Statistics(date=date, views=val, clicks=val, cost=val)
+
+    statistics, created = summarize_or_create_statistics(
+        db, new_statistics, idempotency_key=key
+    )
+    assert created
+    assert is_idempotency_key_used(db, key)
+
+    with pytest.raises(DuplicateEventException):
+        summarize_or_create_statistics(db, new_statistics, idempotency_key=key)
+    assert get_statistics_for_date(db, date).views == val
+
+    statistics, created = summarize_or_create_statistics(
+        db, new_statistics, idempotency_key=f"{key}-retry"
+    )
+    assert created is False
+    assert statistics.views == val * 2
+
+
+def test_delete_expired_idempotency_keys(db: Session) -> None:
+    """Testing the bulk deletion of expired idempotency keys and keys
+    above the limit.
+    """
+    now = datetime.datetime.utcnow()
+    for i in range(5):
+        db.add(models.IdempotencyKey(key=f"key-{i}", created_at=now - timedelta(i)))
+    db.commit()
+
+    deleted = delete_expired_idempotency_keys(db, expired_before=now - timedelta(3.5))
+    assert deleted == 1
+    assert not is_idempotency_key_used(db, "key-4")
+
+    deleted = delete_expired_idempotency_keys(
+        db, expired_before=now - timedelta(3.5), max_keys=2
+    )
+    assert deleted == 2
+    assert db.query(models.IdempotencyKey).count() == 2
+    assert is_idempotency_key_used(db, "key-0")
+    assert is_idempotency_key_used(db, "key-1")
+
+
+@pytest.mark.parametrize(
+    "sort_by, limit, ascending, days",
+    [
+        ("cost", 2, False, [3, 2]),
+        ("cost", 5, True, [1, 2, 3]),
+        ("views", 1, False, [3]),
+        ("cpc", 3, False, [1, 2, 3]),
+    ]
+)
+def test_get_top_statistics(
+    db_with_data: Session, sort_by: str, limit: int, ascending: bool,
+    days: list[int]
+) -> None:
+    """Test getting days with the largest or the smallest values of a field."""
+    statistics = get_top_statistics(db_with_data, sort_by, limit, ascending)
+    assert [stat.date.day for stat in statistics] == days
+
+
+def test_get_top_statistics_derived_metric_not_defined(db: Session) -> None:
+    """Test that days without clicks are not ranked by cpc."""
+    db.add(models.Statistics(date=datetime.date(2000, 1, 1), views=1, clicks=0, cost=5))
+    db.add(models.Statistics(date=datetime.date(2000, 1, 2), views=1, clicks=2, cost=5))
+    db.commit()
+    statistics = get_top_statistics(db, "cpc", 10)
+    assert [stat.date.day for stat in statistics] == [2]
+
+
+def test_get_statistics_percentiles(db_with_data: Session) -> None:
+    """Test computing percentiles of metrics over a date period."""
+    percentiles = get_statistics_percentiles(
+        db_with_data, [0, .5, .75, 1], date_to=datetime.date(2000, 1, 3)
+    )
+    assert percentiles["views"] == [VIEWS_COUNT, VIEWS_COUNT * 2,
+                                    VIEWS_COUNT * 2.5, VIEWS_COUNT * 3]
+    assert percentiles["cpc"] == [COSTS_VALUE / CLICKS_COUNT] * 4
+
+    percentiles = get_statistics_percentiles(
+        db_with_data, [.5], date_from=datetime.date(2001, 1, 1)
+    )
+    assert percentiles["cost"] == [None]
+
+
+@pytest.fixture()
+def totals_enabled(monkeypatch) -> None:
+    """Enables maintaining prefix sums of statistics."""
+    settings = TotalsSettings(enabled=True)
+    monkeypatch.setattr(crud, "get_totals_settings", lambda: settings)
+    monkeypatch.setattr(importer, "get_totals_settings", lambda: settings)
+
+
+def test_get_running_statistics(db_with_data: Session) -> None:
+    """Testing cumulative sums and moving windows, including the days
+    preceding the period and the days without statistics.
+    """
+    db_with_data.add(models.Statistics(
+        date=datetime.date(2000, 1, 5), views=1000, clicks=10, cost=1.0
+    ))
+    db_with_data.commit()
+
+    rows = get_running_statistics(
+        db_with_data, [2], date_from=datetime.date(2000, 1, 2),
+        date_to=datetime.date(2000, 1, 5),
+    )
+    assert [row.date for row in rows] == [
+        datetime.date(2000, 1, 2), datetime.date(2000, 1, 3), datetime.date(2000, 1, 5)
+    ]
+    assert [row.cumulative_views for row in rows] == [300, 600, 1600]
+    assert [row.cumulative_cost for row in rows] == [90.0, 180.0, 181.0]
+    # The window of 2000-01-05 covers 2000-01-04 without statistics
+    assert [row.moving_2_views for row in rows] == [300, 500, 1000]
+    assert [row.moving_2_clicks for row in rows] == [450, 750, 10]
+
+
+@pytest.mark.parametrize(
+    "date_from, date_to, total",
+    [
+        (None, None, (600, 900, 180.0)),
+        (datetime.date(2000, 1, 2), None, (500, 750, 150.0)),
+        (None, datetime.date(2000, 1, 2), (300, 450, 90.0)),
+        (datetime.date(2000, 1, 2), datetime.date(2000, 1, 2), (200, 300, 60.0)),
+        (datetime.date(2001, 1, 1), None, (0, 0, 0)),
+        (datetime.date(2000, 1, 3), datetime.date(2000, 1, 1), (0, 0, 0)),
+    ],
+)
+@pytest.mark.parametrize("cached", [False, True])
+def test_get_statistics_total(
+    db_with_data: Session, request, cached: bool,
+    date_from: datetime.date, date_to: datetime.date, total: tuple
+) -> None:
+    """Testing totals of date periods with and without prefix sums."""
+    if cached:
+        request.getfixturevalue("totals_enabled")
+        refresh_statistics_totals(db_with_data)
+        db_with_data.commit()
+    assert get_statistics_total(db_with_data, date_from, date_to) == total
+
+
+def _prefix_sums(db: Session) -> list[tuple]:
+    return [
+        (total.date, total.views, total.clicks, round(total.cost, 2))
+        for total in db.query(models.StatisticsTotal).order_by(
+            models.StatisticsTotal.date
+        )
+    ]
+
+
+def test_prefix_sums_are_maintained(db: Session, totals_enabled) -> None:
+    """Testing that the write paths keep prefix sums equal to rebuilt ones."""
+    for day, views in ((3, 30), (1, 10), (3, 5), (2, 20)):
+        summarize_or_create_statistics(db, schemas.Statistics(
+            date=datetime.date(2000, 1, day), views=views, clicks=1, cost=1.5
+        ))
+    summarize_statistics_batch(db, [
+        schemas.StatisticsEvent(date="2000-01-02", views=1),
+        schemas.StatisticsEvent(date="1999-12-31", views=100),
+    ])
+    db.commit()
+    import_statistics(db, [(1, {"date": "2000-01-01", "views": "1"})])
+
+    maintained = _prefix_sums(db)
+    assert maintained[-1] == (datetime.date(2000, 1, 3), 167, 4, 6.0)
+    refresh_statistics_totals(db)
+    db.commit()
+    assert _prefix_sums(db) == maintained
+
+    delete_all_statistics(db)
+    assert _prefix_sums(db) == []
+
+
+def test_statistics_are_isolated_by_tenant(db: Session, totals_enabled) -> None:
+    """Testing that statistics, idempotency keys and prefix sums of tenants
+    are separate and that a reset clears only the statistics of the tenant.
+    """
+    statistics = schemas.Statistics(date="2000-01-01", views=10, clicks=1, cost=1)
+    summarize_or_create_statistics(db, statistics, idempotency_key="event")
+    summarize_or_create_statistics(
+        db, statistics, idempotency_key="event", tenant_id="team_a"
+    )
+    summarize_or_create_statistics(db, statistics, tenant_id="team_a")
+    import_statistics(
+        db, [(1, {"date": "2000-01-02", "views": "5"})], tenant_id="team_a"
+    )
+
+    assert get_statistics_for_date(db, datetime.date(2000, 1, 1)).views == 10
+    assert len(get_statistics_for_date_period(db)) == 1
+    assert len(get_statistics_for_date_period(db, tenant_id="team_a")) == 2
+    assert get_statistics_total(db) == (10, 1, 1.0)
+    assert get_statistics_total(db, tenant_id="team_a") == (25, 2, 2.0)
+    assert sorted(crud.get_tenants(db)) == ["default", "team_a"]
+
+    delete_all_statistics(db, tenant_id="team_a")
+    assert get_statistics_for_date_period(db, tenant_id="team_a") == []
+    assert get_statistics_total(db, tenant_id="team_a") == (0, 0, 0)
+    assert len(get_statistics_for_date_period(db)) == 1
+    assert get_statistics_total(db) == (10, 1, 1.0)
+
+
+def test_create_tenant_partition_requires_partitioned_table(db: Session) -> None:
+    """Testing that partitions are not created for a table that is not
+    partitioned by tenant (SQLite) or for an invalid tenant id.
+    """
+    with pytest.raises(ValueError):
+        crud.create_tenant_partition(db, "team_a")
+    with pytest.raises(ValueError):
+        crud.create_tenant_partition(db, "Team A; DROP TABLE statistic")
@@ -0,0 +1,54 @@
+from sqlalchemy import create_engine, event
+
+from app import database
+from app.settings import get_db_settings
+
+
+def test_database_url() -> None:
+    """Testing building of the database URL from the configuration."""
+    db_settings = get_db_settings()
+    url = database.get_database_url(db_settings)
+    assert url.startswith(f"{db_settings.engine}://{db_settings.user}:")
+    assert url.endswith(
+        f"@{db_settings.host}:{db_settings.port}/{db_settings.database}"
+    )
+
+
+def test_init_and_dispose_engine() -> None:
+    """Testing that the engine of the process is created with the configured pool
+    and sessions are bound to it.
+    """
+    db_settings = get_db_settings()
+    engine = database.init_engine(db_settings)
+    try:
+        assert database.engine is engine
+        assert engine.pool.size() == db_settings.pool_size
+        assert database.SessionLocal.kw["bind"] is engine
+    finally:
+        database.dispose_engine()
+    assert database.engine is None
+
+
+def test_engine_listeners_are_removed() -> None:
+    """Testing that the listeners of the circuit breaker do not pile up
+    when an engine is used repeatedly and are removed on disposal.
+    """
+    engine = create_engine("sqlite://")
+    database.use_engine(engine)
+    first_listeners = list(database._engine_listeners)
+    database.use_engine(engine)
+    try:
+        assert not any(
+            event.contains(engine, name, listener)
+            for name, listener in first_listeners
+        )
+        assert all(
+            event.contains(engine, name, listener)
+            for name, listener in database._engine_listeners
+        )
+        last_listeners = list(database._engine_listeners)
+    finally:
+        database.dispose_engine()
+    assert not any(
+        event.contains(engine, name, listener) for name, listener in last_listeners
+    )
@@ -0,0 +1,16 @@
+import datetime
+
+from app import schemas
+from app.generator import generate_statistics
+
+
+def test_generate_statistics() -> None:
+    """Testing that generated rows are valid, consecutive and reproducible."""
+    rows = list(generate_statistics(1, start=datetime.date(2000, 1, 1), seed=1))
+    assert len(rows) == 365
+    assert [row_number for row_number, _ in rows] == list(range(1, 366))
+    assert rows[-1][1]["date"] == datetime.date(2000, 12, 30)
+    for _, row in rows:
+        schemas.Statistics(**row)
+        assert row["clicks"] <= row["views"]
+    assert rows == list(generate_statistics(1, start=datetime.date(2000, 1, 1), seed=1))
@@ -1,6 +1,9 @@
+import pytest
 from fastapi.testclient import TestClient
 
+from app import tenants
 from app.main import app
+from app.settings import TenantSettings
 
 client = TestClient(app)
 
@@ -40,3 +43,197 @@ def test_reset_statistics_handler(db_handlers) -> None:
     response = client.delete("/api/statistics")
     assert response.status_code == 200
     assert response.json() == {"message": "Deleted", "error": 0}
+
+
+def test_save_statistics_handlers_with_idempotency_key(db_handlers) -> None:
+    """Testing that a retried POST request with the same 'Idempotency-Key'
+    header is not summarized again.
+    """
+    request_json = {"date": "2000-01-01", "views": 100, "clicks": 200, "cost": 10.0}
+    headers = {"Idempotency-Key": "batch-1"}
+
+    response = client.post("/api/statistics", json=request_json, headers=headers)
+    assert response.status_code == 201
+
+    response = client.post("/api/statistics", json=request_json, headers=headers)
+    assert response.status_code == 200
+
+    response = client.get("/api/statistics")
+    assert response.json()["2000-01-01"]["views"] == request_json["views"]
+
+
+def test_import_statistics_handler(db_handlers) -> None:
+    """Testing accessing '/api/statistics/import' via POST request."""
+    data = b"date,views,clicks,cost\n2000-01-01,100,10,1.5\nbad,1,1,1\n"
+    response = client.post(
+        "/api/statistics/import", files={"file": ("data.csv", data, "text/csv")}
+    )
+    assert response.status_code == 200
+    assert response.json()["imported"] == 1
+    assert response.json()["rejected"][0]["row"] == 3
+
+    response = client.get("/api/statistics")
+    assert response.json()["2000-01-01"]["views"] == 100
+
+
+def test_top_and_percentiles_handlers(db_handlers) -> None:
+    """Testing accessing '/api/statistics/top' and '/api/statistics/percentiles'
+    via GET requests.
+    """
+    for day, cost in ((1, 10), (2, 30), (3, 20)):
+        client.post("/api/statistics", json={
+            "date": f"2000-01-0{day}", "views": 1000, "clicks": 10, "cost": cost
+        })
+
+    response = client.get("/api/statistics/top?sort_by=cpm&limit=2")
+    assert response.status_code == 200
+    assert list(response.json()) == ["2000-01-02", "2000-01-03"]
+
+    response = client.get("/api/statistics/top?sort_by=unknown")
+    assert response.status_code == 422
+
+    response = client.get(
+        "/api/statistics/percentiles?percentiles=0.5&percentiles=1"
+    )
+    assert response.status_code == 200
+    assert response.json()["cost"] == {"0.5": 20.0, "1.0": 30.0}
+
+    response = client.get("/api/statistics/percentiles?percentiles=2")
+    assert response.status_code == 422
+
+
+def test_get_statistics_handler_columnar_format(db_handlers) -> None:
+    """Testing accessing '/api/statistics' via GET request in the columnar format."""
+    for day in (2, 1):
+        client.post("/api/statistics", json={
+            "date": f"2000-01-0{day}", "views": 1000, "clicks": 10, "cost": day
+        })
+    columns = {
+        "date": ["2000-01-01", "2000-01-02"],
+        "views": [1000, 1000],
+        "clicks": [10, 10],
+        "cost": [1.0, 2.0],
+        "cpc": [0.1, 0.2],
+        "cpm": [1.0, 2.0],
+    }
+
+    response = client.get("/api/statistics?format=columnar")
+    assert response.status_code == 200
+    assert response.json() == columns
+    assert "Accept" not in response.headers.get("Vary", "")
+
+    response = client.get(
+        "/api/statistics",
+        headers={"Accept": "application/vnd.statistics.columnar+json"}
+    )
+    assert response.json() == columns
+    assert "Accept" in response.headers["Vary"].split(", ")
+    assert "Accept" in client.get("/api/statistics").headers["Vary"].split(", ")
+
+
+def test_running_and_total_handlers(db_handlers) -> None:
+    """Testing accessing '/api/statistics/running' and '/api/statistics/total'
+    via GET requests.
+    """
+    for day, cost in ((1, 10), (2, 30), (3, 20)):
+        client.post("/api/statistics", json={
+            "date": f"2000-01-0{day}", "views": 1000, "clicks": 10, "cost": cost
+        })
+
+    response = client.get(
+        "/api/statistics/running?windows=2&date_from=2000-01-02"
+    )
+    assert response.status_code == 200
+    statistics = response.json()
+    assert list(statistics) == ["2000-01-02", "2000-01-03"]
+    assert statistics["2000-01-03"]["cost"] == 20.0
+    assert statistics["2000-01-03"]["cumulative"] == {
+        "views": 3000, "clicks": 30, "cost": 60.0, "cpc": 2.0, "cpm": 20.0
+    }
+    assert statistics["2000-01-03"]["moving"] == {
+        "2": {"views": 2000, "clicks": 20, "cost": 50.0, "cpc": 2.5, "cpm": 25.0}
+    }
+
+    response = client.get("/api/statistics/running?windows=0")
+    assert response.status_code == 422
+
+    response = client.get("/api/statistics/total?date_from=2000-01-02")
+    assert response.status_code == 200
+    assert response.json() == {
+        "views": 2000, "clicks": 20, "cost": 50.0, "cpc": 2.5, "cpm": 25.0
+    }
+
+
+@pytest.fixture()
+def tenant_keys(monkeypatch) -> dict:
+    """Configures the API key of the tenant 'team_a' (requests without a key
+    belong to the default tenant) and returns its header.
+    """
+    settings = TenantSettings(api_keys={"key-a": "team_a"}, allow_anonymous=True)
+    monkeypatch.setattr(tenants, "get_tenant_settings", lambda: settings)
+    return {settings.api_key_header: "key-a"}
+
+
+def test_statistics_handlers_are_scoped_by_tenant(
+    db_handlers, tenant_keys: dict
+) -> None:
+    """Testing that requests with an API key see and reset only the statistics
+    of its tenant and that requests with an unknown key are rejected.
+    """
+    request_json = {"date": "2000-01-01", "views": 100}
+    client.post("/api/statistics", json=request_json)
+    response = client.post("/api/statistics", json=request_json, headers=tenant_keys)
+    assert response.json()["created"]
+    client.post(
+        "/api/statistics", json={"date": "2000-01-02", "views": 1},
+        headers=tenant_keys
+    )
+
+    assert list(client.get("/api/statistics").json()) == ["2000-01-01"]
+    assert list(client.get("/api/statistics", headers=tenant_keys).json()) == \
+        ["2000-01-01", "2000-01-02"]
+    response = client.get("/api/statistics/total", headers=tenant_keys)
+    assert response.json()["views"] == 101
+
+    response = client.get("/api/statistics", headers={"X-API-Key": "unknown"})
+    assert response.status_code == 401
+
+    client.delete("/api/statistics", headers=tenant_keys)
+    assert client.get("/api/statistics", headers=tenant_keys).json() == {}
+    assert list(client.get("/api/statistics").json()) == ["2000-01-01"]
+
+
+def test_anonymous_requests_are_rejected_with_api_keys(
+    db_handlers, monkeypatch
+) -> None:
+    """Testing that requests without an API key are rejected if API keys are
+    configured and anonymous access is not allowed.
+    """
+    settings = TenantSettings(api_keys={"key-a": "team_a"})
+    monkeypatch.setattr(tenants, "get_tenant_settings", lambda: settings)
+
+    response = client.get("/api/statistics")
+    assert response.status_code == 401
+    assert response.json() == {"detail": "API key required"}
+    assert client.delete("/api/statistics").status_code == 401
+    assert client.get(
+        "/api/statistics", headers={"X-API-Key": "key-a"}
+    ).status_code == 200
+
+
+def test_api_keys_are_ignored_without_configured_keys(
+    db_handlers, monkeypatch
+) -> None:
+    """Testing that requests with an API key belong to the default tenant if
+    no API keys are configured.
+    """
+    monkeypatch.setattr(tenants, "get_tenant_settings", lambda: TenantSettings())
+    headers = {"X-API-Key": "client-1"}
+
+    response = client.post(
+        "/api/statistics", json={"date": "2000-01-01", "views": 100}, headers=headers
+    )
+    assert response.status_code == 201
+    assert list(client.get("/api/statistics").json()) == ["2000-01-01"]
+    assert list(client.get("/api/statistics", headers=headers).json()) == \
+        ["2000-01-01"]
@@ -0,0 +1,122 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool, QueuePool
+
+from app import breaker as breaker_module
+from app import database
+from app.breaker import CLOSED, OPEN
+from app.database import Base
+from app.health import _pool_state, database_ping
+from app.ingest import _segment_path, get_ingest_log, start_ingest, stop_ingest
+from app.main import create_app
+from app.settings import IngestSettings, get_db_settings
+
+
+@pytest.fixture()
+def client(tmp_path) -> TestClient:
+    """Returns a client of an application with a test database in the directory
+    'data' (each query opens a new connection to the database file).
+    """
+    (tmp_path / "data").mkdir()
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'data' / 'test.db'}",
+        connect_args={"check_same_thread": False}, poolclass=NullPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    database_ping.checked_at = None
+    try:
+        with TestClient(create_app(engine=engine)) as client:
+            yield client
+    finally:
+        database.dispose_engine()
+
+
+def test_liveness_and_readiness(client: TestClient) -> None:
+    """Testing the health checks of a worker with an available database."""
+    assert client.get("/health/live").json() == {"status": "alive"}
+
+    response = client.get("/health/ready")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+    assert response.json()["checks"]["circuit"] == "closed"
+    assert response.json()["checks"]["database"]["latency"] is not None
+
+
+def test_statement_errors_do_not_open_circuit(client: TestClient) -> None:
+    """Testing that errors of statements are not failures of the database."""
+    with database.get_engine().connect() as connection:
+        for _ in range(database.breaker.failure_threshold):
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM missing_table"))
+    assert database.breaker.state == CLOSED
+    assert database.breaker.failures == 0
+
+
+def test_open_circuit_fails_fast(
+    client: TestClient, tmp_path, monkeypatch
+) -> None:
+    """Testing that failures to connect to the database open the circuit,
+    after which requests and readiness checks fail fast with 503.
+    """
+    (tmp_path / "data").rename(tmp_path / "unavailable")
+    for _ in range(database.breaker.failure_threshold):
+        with pytest.raises(OperationalError):
+            database.get_engine().connect()
+    assert database.breaker.state == OPEN
+
+    response = client.get("/api/statistics")
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert client.get("/health/ready").status_code == 503
+    assert client.get("/health/live").status_code == 200
+    assert client.get("/api/metrics").json()["circuit_breaker"]["rejected"] == 1
+
+    # Once the database is available again, queries of background tasks do not
+    # close the circuit, the probe request after the reset timeout does
+    (tmp_path / "unavailable").rename(tmp_path / "data")
+    with database.get_engine().connect() as connection:
+        connection.execute(text("SELECT 1"))
+    assert database.breaker.state == OPEN
+    later = time.monotonic() + database.breaker.reset_timeout
+    monkeypatch.setattr(breaker_module.time, "monotonic", lambda: later)
+    assert client.get("/api/statistics").status_code == 200
+    assert database.breaker.state == CLOSED
+
+
+def test_open_circuit_accepts_events_into_ingest_log(
+    client: TestClient, tmp_path
+) -> None:
+    """Testing that events are saved to the ingest log while the circuit is open."""
+    start_ingest(IngestSettings(
+        enabled=True, directory=str(tmp_path / "ingest"), poll_interval=0.05
+    ))
+    try:
+        for _ in range(database.breaker.failure_threshold):
+            database.breaker.record_failure()
+        assert database.breaker.state == OPEN
+
+        response = client.post(
+            "/api/statistics", json={"date": "2022-06-01", "views": 1}
+        )
+        assert response.status_code == 202
+        log = get_ingest_log()
+        assert _segment_path(log.directory, log.segment).stat().st_size > 0
+        assert client.get("/api/statistics").status_code == 503
+    finally:
+        stop_ingest()
+
+
+def test_pool_state() -> None:
+    """Testing the capacity of the pool with the configured overflow."""
+    database.use_engine(create_engine("sqlite://", poolclass=QueuePool, pool_size=2))
+    try:
+        with database.get_engine().connect():
+            assert _pool_state() == {
+                "checked_out": 1, "capacity": 2 + get_db_settings().max_overflow
+            }
+    finally:
+        database.dispose_engine()
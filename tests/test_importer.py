@@ -0,0 +1,99 @@
+import datetime
+import io
+import tempfile
+
+import pytest
+from sqlalchemy.orm import Session
+
+from app import models
+from app.crud import get_statistics_for_date, get_statistics_for_date_period
+from app.exceptions import UnsupportedFormatException
+from app.importer import detect_format, import_statistics, read_csv, read_rows
+
+CSV_DATA = (
+    "date,views,clicks,cost\n"
+    "2000-01-01,100,10,1.5\n"
+    "2000-01-02,200,20,\n"
+    "not-a-date,1,1,1\n"
+    "2000-01-01,100,10,1.5\n"
+    "2000-01-03,-1,0,0\n"
+    "2000-01-03,,,\n"
+)
+
+
+def test_read_csv_line_numbers() -> None:
+    """Testing that rows of a CSV file are numbered by lines of the file."""
+    rows = list(read_csv(io.BytesIO(CSV_DATA.encode())))
+    assert [row_number for row_number, _ in rows] == [2, 3, 4, 5, 6, 7]
+    assert rows[0][1] == {"date": "2000-01-01", "views": "100", "clicks": "10",
+                          "cost": "1.5"}
+
+
+def test_read_csv_upload_file() -> None:
+    """Testing reading an uploaded file (a SpooledTemporaryFile) with a BOM,
+    CRLF line endings and a quoted multi-line value.
+    """
+    with tempfile.SpooledTemporaryFile() as file:
+        file.write(
+            '\ufeffdate,views\r\n2000-01-01,100\r\n"2000-01-\n02",200\r\n'.encode()
+        )
+        file.seek(0)
+        rows = list(read_csv(file))
+    assert rows == [
+        (2, {"date": "2000-01-01", "views": "100"}),
+        (4, {"date": "2000-01-\n02", "views": "200"}),
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 100])
+def test_import_statistics(db: Session, chunk_size: int) -> None:
+    """Testing that valid rows are summarized by date with existing statistics
+    and invalid rows are rejected with their line numbers.
+    """
+    db.add(models.Statistics(date=datetime.date(2000, 1, 2), views=1, clicks=1, cost=1))
+    db.commit()
+
+    report = import_statistics(
+        db, read_csv(io.BytesIO(CSV_DATA.encode())), chunk_size=chunk_size
+    )
+    assert report.imported == 4
+    assert report.rejected_count == 2
+    assert [rejected.row for rejected in report.rejected] == [4, 6]
+    assert report.rejected[0].error.startswith("date:")
+
+    first_day = get_statistics_for_date(db, datetime.date(2000, 1, 1))
+    assert (first_day.views, first_day.clicks, first_day.cost) == (200, 20, 3.0)
+    second_day = get_statistics_for_date(db, datetime.date(2000, 1, 2))
+    assert (second_day.views, second_day.clicks, second_day.cost) == (201, 21, 1.0)
+    assert len(get_statistics_for_date_period(db)) == 3
+
+
+@pytest.mark.parametrize(
+    "filename, file_format",
+    [("data.csv", "csv"), ("DATA.PARQUET", "parquet"), ("data", "csv")]
+)
+def test_detect_format(filename: str, file_format: str) -> None:
+    """Testing the detection of the file format by the extension."""
+    assert detect_format(filename) == file_format
+
+
+def test_read_rows_unsupported_format() -> None:
+    """Testing an error when trying to read a file of an unknown format."""
+    with pytest.raises(UnsupportedFormatException):
+        read_rows(io.BytesIO(), "xlsx")
+
+
+def test_import_parquet(db: Session) -> None:
+    """Testing the import of statistics from a Parquet file."""
+    pyarrow = pytest.importorskip("pyarrow")
+    parquet = pytest.importorskip("pyarrow.parquet")
+    buffer = io.BytesIO()
+    parquet.write_table(pyarrow.table({
+        "date": [datetime.date(2000, 1, 1), datetime.date(2000, 1, 1)],
+        "views": [1, 2], "clicks": [3, 4], "cost": [.5, .25],
+    }), buffer)
+    buffer.seek(0)
+
+    report = import_statistics(db, read_rows(buffer, "parquet"))
+    assert report.imported == 2
+    assert get_statistics_for_date(db, datetime.date(2000, 1, 1)).views == 3
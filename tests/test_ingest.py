@@ -0,0 +1,175 @@
+import datetime
+import threading
+
+import pytest
+from sqlalchemy.orm import Session
+
+from app import models, schemas
+from app.crud import get_ingest_checkpoint, get_statistics_for_date
+from app.ingest import (
+    IngestConsumer,
+    IngestLog,
+    _claim_directory,
+    _claim_orphaned_directories,
+    _list_segments,
+    _segment_path,
+    drain_orphaned_directories
+)
+from app.settings import IngestSettings
+
+EVENTS_COUNT = 30
+SEGMENT_SIZE = 512
+
+
+@pytest.fixture()
+def ingest_log(tmp_path) -> IngestLog:
+    """Returns the ingest log with small segments in a temporary directory."""
+    log = IngestLog(tmp_path, SEGMENT_SIZE)
+    yield log
+    log.close()
+
+
+def _apply_all(consumer: IngestConsumer) -> None:
+    while consumer.apply_next_batch():
+        pass
+
+
+def test_ingest_log_rotates_segments(ingest_log: IngestLog) -> None:
+    """Testing that the log is split into segments of limited size."""
+    for _ in range(EVENTS_COUNT):
+        ingest_log.append(schemas.StatisticsEvent(date="2000-01-01", views=1))
+    segments = _list_segments(ingest_log.directory)
+    assert len(segments) > 1
+    assert segments[-1] == ingest_log.segment
+
+
+def test_ingest_log_concurrent_appends(ingest_log: IngestLog) -> None:
+    """Testing that appends do not fail when a concurrent append rotates
+    the segment being synced.
+    """
+    errors = []
+
+    def append() -> None:
+        try:
+            for _ in range(EVENTS_COUNT):
+                ingest_log.append(schemas.StatisticsEvent(date="2000-01-01", views=1))
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=append) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_ingest_consumer_applies_events(db: Session, ingest_log: IngestLog) -> None:
+    """Testing that events are aggregated by date and applied to the database,
+    and that fully applied segments are deleted.
+    """
+    for i in range(EVENTS_COUNT):
+        ingest_log.append(schemas.StatisticsEvent(
+            date=datetime.date(2000, 1, i % 2 + 1), views=1, clicks=2, cost=0.5
+        ))
+    consumer = IngestConsumer(ingest_log, batch_size=7, poll_interval=0,
+                              session_factory=lambda: db)
+    _apply_all(consumer)
+
+    for day in (1, 2):
+        statistics = get_statistics_for_date(db, datetime.date(2000, 1, day))
+        assert statistics.views == EVENTS_COUNT // 2
+        assert statistics.clicks == EVENTS_COUNT
+        assert statistics.cost == EVENTS_COUNT / 4
+    assert _list_segments(ingest_log.directory) == [ingest_log.segment]
+    assert consumer.metrics()["lag_bytes"] == 0
+    assert consumer.metrics()["applied_events"] == EVENTS_COUNT
+
+
+def test_ingest_consumer_applies_events_by_tenant(
+    db: Session, ingest_log: IngestLog
+) -> None:
+    """Testing that events are applied to the statistics of their tenants and
+    that events written without a tenant belong to the default tenant.
+    """
+    event = schemas.StatisticsEvent(date="2000-01-01", views=1)
+    ingest_log.append(event, "team_a")
+    ingest_log.append(event, "team_a")
+    ingest_log.append(event)
+    with open(_segment_path(ingest_log.directory, ingest_log.segment), "ab") as file:
+        file.write(b'{"date":"2000-01-01","views":5}\n')
+    consumer = IngestConsumer(ingest_log, batch_size=10, poll_interval=0,
+                              session_factory=lambda: db)
+    _apply_all(consumer)
+
+    date = datetime.date(2000, 1, 1)
+    assert get_statistics_for_date(db, date, "team_a").views == 2
+    assert get_statistics_for_date(db, date).views == 6
+
+
+def test_ingest_consumer_replays_from_checkpoint(
+    db: Session, ingest_log: IngestLog
+) -> None:
+    """Testing that a restarted consumer continues from the saved checkpoint
+    without applying events twice.
+    """
+    for _ in range(EVENTS_COUNT):
+        ingest_log.append(schemas.StatisticsEvent(date="2000-01-01", views=1))
+    consumer = IngestConsumer(ingest_log, batch_size=10, poll_interval=0,
+                              session_factory=lambda: db)
+    consumer.apply_next_batch()
+    checkpoint = get_ingest_checkpoint(db, consumer.name)
+    assert (checkpoint.segment, checkpoint.offset) == (consumer.segment,
+                                                       consumer.offset)
+
+    restarted_consumer = IngestConsumer(ingest_log, batch_size=10, poll_interval=0,
+                                        session_factory=lambda: db)
+    _apply_all(restarted_consumer)
+    assert get_statistics_for_date(
+        db, datetime.date(2000, 1, 1)
+    ).views == EVENTS_COUNT
+
+
+def test_ingest_consumer_skips_duplicate_events(
+    db: Session, ingest_log: IngestLog
+) -> None:
+    """Testing that events with already used idempotency keys are not applied."""
+    db.add(models.IdempotencyKey(key="applied"))
+    db.commit()
+    for key in ("applied", "new", "new", None):
+        ingest_log.append(schemas.StatisticsEvent(
+            date="2000-01-01", views=1, idempotency_key=key
+        ))
+    consumer = IngestConsumer(ingest_log, batch_size=10, poll_interval=0,
+                              session_factory=lambda: db)
+    _apply_all(consumer)
+    assert get_statistics_for_date(db, datetime.date(2000, 1, 1)).views == 2
+
+
+def test_orphaned_directories_are_drained(db: Session, tmp_path) -> None:
+    """Testing that events left in a subdirectory of a worker process that no
+    longer runs (after a restart with fewer workers) are applied.
+    """
+    (tmp_path / "worker-3").mkdir()
+    orphaned_log = IngestLog(tmp_path / "worker-3", SEGMENT_SIZE)
+    for _ in range(EVENTS_COUNT):
+        orphaned_log.append(schemas.StatisticsEvent(date="2000-01-01", views=1))
+    orphaned_log.close()
+
+    directory, lock_file = _claim_directory(tmp_path)
+    try:
+        orphaned = _claim_orphaned_directories(tmp_path, directory)
+        assert [orphaned_directory for orphaned_directory, _ in orphaned] == \
+            [tmp_path / "worker-3"]
+        drain_orphaned_directories(
+            orphaned, IngestSettings(poll_interval=0), threading.Event(),
+            session_factory=lambda: db,
+        )
+    finally:
+        lock_file.close()
+
+    assert get_statistics_for_date(
+        db, datetime.date(2000, 1, 1)
+    ).views == EVENTS_COUNT
+    assert _list_segments(tmp_path / "worker-3") == []
+    assert _claim_orphaned_directories(tmp_path, directory) == []
@@ -0,0 +1,175 @@
+import asyncio
+import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from starlette.websockets import WebSocketDisconnect
+
+from app import database, models, router, tenants
+from app.database import Base
+from app.live import RESYNC, ChangeBroker, Subscription, track_changes
+from app.main import create_app
+from app.settings import TenantSettings
+from app.tenants import DEFAULT_TENANT
+
+
+@pytest.fixture()
+def engine(tmp_path):
+    """Returns the engine of a temporary database used by the whole application."""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    database.dispose_engine()
+
+
+def test_subscription_overflow() -> None:
+    """Testing that a subscriber that does not keep up receives a single resync
+    message instead of an unbounded number of messages.
+    """
+    async def check():
+        subscription = Subscription(None, None, max_pending=2)
+        for i in range(5):
+            subscription.put({"type": "delta", "number": i})
+        assert subscription.overflows == 2
+        assert await subscription.get() == {"type": RESYNC}
+        subscription.put({"type": "delta", "number": 5})
+        assert (await subscription.get())["number"] == 5
+
+    asyncio.run(check())
+
+
+@pytest.mark.parametrize(
+    "date_from, date_to, delivered",
+    [
+        (None, None, ["2000-01-01", "2000-01-05"]),
+        (datetime.date(2000, 1, 2), None, ["2000-01-05"]),
+        (datetime.date(2000, 1, 2), datetime.date(2000, 1, 4), []),
+    ]
+)
+def test_broker_coalesces_changes(
+    engine, date_from: datetime.date, date_to: datetime.date, delivered: list[str]
+) -> None:
+    """Testing that changes of a tick are delivered in one message only to
+    subscribers whose range includes the changed dates.
+    """
+    database.use_engine(engine)
+    db = Session(bind=engine)
+    for day in (1, 5):
+        db.add(models.Statistics(
+            date=datetime.date(2000, 1, day), views=day, clicks=day, cost=day
+        ))
+    db.commit()
+
+    async def check():
+        broker = ChangeBroker(tick=0, max_pending=10)
+        subscription = broker.subscribe(date_from, date_to)
+        broker.publish({DEFAULT_TENANT: {datetime.date(2000, 1, 1)}})
+        broker.publish({
+            DEFAULT_TENANT: {datetime.date(2000, 1, 5), datetime.date(2000, 1, 1)},
+            "other": {datetime.date(2000, 1, 5)},
+        })
+        await broker.deliver()
+        await broker.deliver()
+        if not delivered:
+            assert broker.delivered_messages == 0
+            return
+        message = await subscription.get()
+        assert message["type"] == "delta"
+        assert sorted(message["statistics"]) == delivered
+        assert broker.delivered_messages == 1
+
+    asyncio.run(check())
+
+
+def test_changes_are_tracked_until_commit(engine) -> None:
+    """Testing that changed dates are discarded when the transaction is rolled back."""
+    db = Session(bind=engine)
+    db.add(models.Statistics(date=datetime.date(2000, 1, 1), views=1, clicks=1, cost=1))
+    db.flush()
+    track_changes(db, [datetime.date(2000, 1, 1)])
+    assert db.info
+    db.rollback()
+    assert not db.info
+
+
+def test_statistics_live_handler(engine) -> None:
+    """Testing accessing '/api/statistics/live' via WebSocket."""
+    with TestClient(create_app(engine=engine)) as client:
+        with client.websocket_connect(
+            "/api/statistics/live?date_from=2000-01-01&date_to=2000-01-31"
+        ) as websocket:
+            client.post("/api/statistics", json={"date": "1999-12-31", "views": 1})
+            client.post("/api/statistics", json={"date": "2000-01-01", "views": 1})
+            client.post("/api/statistics", json={"date": "2000-01-01", "views": 2})
+            message = websocket.receive_json()
+            assert message["type"] == "delta"
+            assert list(message["statistics"]) == ["2000-01-01"]
+            assert message["statistics"]["2000-01-01"]["views"] == 3
+
+            client.delete("/api/statistics")
+            assert websocket.receive_json() == {"type": RESYNC}
+
+
+def test_statistics_live_handler_by_tenant(engine, monkeypatch) -> None:
+    """Testing that a subscriber receives only changes of its tenant and
+    that a connection with an unknown API key is closed.
+    """
+    settings = TenantSettings(api_keys={"key-a": "team_a"}, allow_anonymous=True)
+    monkeypatch.setattr(tenants, "get_tenant_settings", lambda: settings)
+    monkeypatch.setattr(router, "get_tenant_settings", lambda: settings)
+    headers = {"X-API-Key": "key-a"}
+    with TestClient(create_app(engine=engine)) as client:
+        with client.websocket_connect(
+            "/api/statistics/live", headers=headers
+        ) as websocket:
+            client.post("/api/statistics", json={"date": "2000-01-01", "views": 1})
+            client.post(
+                "/api/statistics", json={"date": "2000-01-02", "views": 1},
+                headers=headers
+            )
+            message = websocket.receive_json()
+            assert list(message["statistics"]) == ["2000-01-02"]
+
+        with pytest.raises(WebSocketDisconnect) as error:
+            with client.websocket_connect(
+                "/api/statistics/live", headers={"X-API-Key": "unknown"}
+            ) as websocket:
+                websocket.receive_json()
+        assert error.value.code == 1008
+
+
+def test_statistics_live_handler_key_without_header(engine, monkeypatch) -> None:
+    """Testing that browser clients can enter the API key in the subprotocol
+    or in the query parameter when anonymous access is not allowed.
+    """
+    settings = TenantSettings(api_keys={"key-a": "team_a"})
+    monkeypatch.setattr(tenants, "get_tenant_settings", lambda: settings)
+    monkeypatch.setattr(router, "get_tenant_settings", lambda: settings)
+    with TestClient(create_app(engine=engine)) as client:
+        with client.websocket_connect(
+            "/api/statistics/live", subprotocols=["api-key.key-a"]
+        ) as websocket:
+            assert websocket.accepted_subprotocol == "api-key.key-a"
+            client.post(
+                "/api/statistics", json={"date": "2000-01-01", "views": 1},
+                headers={"X-API-Key": "key-a"}
+            )
+            assert list(websocket.receive_json()["statistics"]) == ["2000-01-01"]
+
+        with client.websocket_connect(
+            "/api/statistics/live?api_key=key-a"
+        ) as websocket:
+            client.post(
+                "/api/statistics", json={"date": "2000-01-02", "views": 1},
+                headers={"X-API-Key": "key-a"}
+            )
+            assert list(websocket.receive_json()["statistics"]) == ["2000-01-02"]
+
+        with pytest.raises(WebSocketDisconnect) as error:
+            with client.websocket_connect("/api/statistics/live") as websocket:
+                websocket.receive_json()
+        assert error.value.code == 1008
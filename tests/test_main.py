@@ -0,0 +1,62 @@
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+
+from app import database
+from app.database import Base
+from app.main import create_app
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+# Budget of the cumulative import time of 'app.main' (seconds)
+IMPORT_TIME_BUDGET = 2.5
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+\d+ \|\s+(\d+) \| +(\S+)$", re.M)
+
+
+def test_import_without_database_configuration(tmp_path) -> None:
+    """Testing that importing the application does not require the environment
+    file, does not create the engine and fits into the import time budget.
+    """
+    env = {
+        key: value for key, value in os.environ.items() if not key.startswith("DB_")
+    }
+    env["PYTHONPATH"] = str(PROJECT_DIR)
+    result = subprocess.run(
+        [
+            sys.executable, "-X", "importtime", "-c",
+            "import app.main, app.database, sys; "
+            "assert app.database.engine is None; "
+            "assert 'psycopg2' not in sys.modules",
+        ],
+        cwd=tmp_path, env=env, capture_output=True, text=True,
+    )
+    assert result.returncode == 0, result.stderr
+
+    # Lines of the form "import time: self [us] | cumulative | imported package"
+    import_times = {
+        package: int(cumulative)
+        for cumulative, package in IMPORT_TIME_LINE.findall(result.stderr)
+    }
+    assert import_times["app.main"] / 1_000_000 < IMPORT_TIME_BUDGET
+
+
+def test_create_app_with_engine(tmp_path) -> None:
+    """Testing the application with an injected engine."""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+
+    try:
+        with TestClient(create_app(engine=engine)) as client:
+            assert database.engine is engine
+            response = client.post("/api/statistics", json={"date": "2000-01-01"})
+            assert response.status_code == 201
+            assert "2000-01-01" in client.get("/api/statistics").json()
+            assert "singleflight" in client.get("/api/metrics").json()
+    finally:
+        database.dispose_engine()
@@ -0,0 +1,180 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import ratelimit
+from app.ratelimit import (
+    MemoryBackend,
+    RateLimitBackend,
+    RateLimiter,
+    RateLimitMiddleware
+)
+from app.settings import RateLimitSettings, TenantSettings, get_db_settings
+
+
+@pytest.fixture()
+def limiter() -> RateLimiter:
+    """Returns a limiter with small limits."""
+    return RateLimiter(RateLimitSettings(
+        enabled=True, read_rate=1, read_burst=3, write_rate=1, write_burst=1,
+        routes={"GET /api/statistics/top": (1, 1)},
+        max_concurrent=1, queue_timeout=.01,
+    ), tenant_settings=TenantSettings(
+        api_keys={"key-a": "team_a", "key-b": "team_b"},
+        write_rate=1, write_burst=2, quotas={"team_b": (1, 1)},
+    ))
+
+
+@pytest.fixture()
+def client(limiter: RateLimiter) -> TestClient:
+    """Returns a client of an application with rate limits."""
+    app = FastAPI()
+    app.add_middleware(RateLimitMiddleware, limiter=limiter)
+    app.state.release = None
+
+    @app.get("/api/statistics")
+    @app.get("/api/statistics/top")
+    @app.get("/api/metrics")
+    async def read():
+        if app.state.release is not None:
+            await app.state.release.wait()
+        return {}
+
+    @app.post("/api/statistics")
+    def write():
+        return {}
+
+    return TestClient(app)
+
+
+def test_memory_backend_refills_tokens(monkeypatch) -> None:
+    """Testing that a bucket allows a burst and is refilled with the rate."""
+    now = 100.0
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now)
+    backend = MemoryBackend()
+
+    async def take() -> float:
+        return await backend.take("client", rate=2, burst=2)
+
+    assert asyncio.run(take()) == 0
+    assert asyncio.run(take()) == 0
+    assert asyncio.run(take()) == .5
+    now += .5
+    assert asyncio.run(take()) == 0
+    assert backend.metrics() == {"buckets": 1}
+
+
+def test_backend_requires_take() -> None:
+    """Testing that a backend without 'take' can not be instantiated."""
+    class IncompleteBackend(RateLimitBackend):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteBackend()
+
+
+def test_memory_backend_drops_full_buckets(monkeypatch) -> None:
+    """Testing that refilled buckets are dropped when there are too many buckets."""
+    now = 100.0
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now)
+    backend = MemoryBackend(max_buckets=2)
+    asyncio.run(backend.take("first", rate=2, burst=1))
+    asyncio.run(backend.take("second", rate=1, burst=1))
+    now += .5
+    asyncio.run(backend.take("third", rate=1, burst=1))
+    assert backend.metrics() == {"buckets": 2}
+
+
+def test_max_concurrent_defaults_to_pool_size(monkeypatch) -> None:
+    """Testing that a worker handles at once as many requests as its pool has
+    connections unless the limit is configured.
+    """
+    db_settings = get_db_settings().copy(update={"pool_size": 5, "max_overflow": 5})
+    monkeypatch.setattr(ratelimit, "get_db_settings", lambda: db_settings)
+
+    assert RateLimiter(RateLimitSettings()).get_max_concurrent() == 10
+    assert RateLimiter(RateLimitSettings(max_concurrent=3)).get_max_concurrent() == 3
+
+
+def test_rate_limit_per_client_and_route(client: TestClient) -> None:
+    """Testing that requests over the burst are rejected with 429 and
+    Retry-After separately for each client and route.
+    """
+    assert [client.get("/api/statistics").status_code for _ in range(4)] == \
+        [200, 200, 200, 429]
+    response = client.get("/api/statistics")
+    assert response.headers["Retry-After"] == "1"
+
+    # Routes have their own buckets and limits
+    assert client.post("/api/statistics").status_code == 200
+    assert client.post("/api/statistics").status_code == 429
+    assert client.get("/api/statistics/top").status_code == 200
+    assert client.get("/api/statistics/top").status_code == 429
+
+    # Clients with an API key have their own buckets
+    headers = {"X-API-Key": "tracker"}
+    assert client.get("/api/statistics", headers=headers).status_code == 200
+
+    # Routes outside the statistics are not limited
+    assert {client.get("/api/metrics").status_code for _ in range(5)} == {200}
+
+
+def test_tenant_write_quota(client: TestClient, limiter: RateLimiter) -> None:
+    """Testing that writes of a tenant are limited by its quota,
+    while reads are not counted.
+    """
+    limiter.settings.write_burst = 100
+    team_a = {"X-API-Key": "key-a"}
+    assert [client.post("/api/statistics", headers=team_a).status_code
+            for _ in range(3)] == [200, 200, 429]
+    response = client.post("/api/statistics", headers=team_a)
+    assert response.json() == {"message": "Tenant write quota exceeded"}
+    assert client.get("/api/statistics", headers=team_a).status_code == 200
+
+    # Tenants have their own quotas
+    team_b = {"X-API-Key": "key-b"}
+    assert client.post("/api/statistics", headers=team_b).status_code == 200
+    assert client.post("/api/statistics", headers=team_b).status_code == 429
+    assert limiter.metrics()["quota_exceeded"] == 3
+
+    # Quotas are checked without the limits of clients
+    limiter.settings.enabled = False
+    assert client.post("/api/statistics", headers=team_b).status_code == 429
+    assert {client.get("/api/statistics").status_code for _ in range(5)} == {200}
+
+
+def test_concurrency_limit(client: TestClient, limiter: RateLimiter) -> None:
+    """Testing that a request over the concurrency limit fails fast with 503."""
+    app = client.app
+
+    async def request() -> int:
+        scope = {
+            "type": "http", "method": "GET", "path": "/api/statistics",
+            "raw_path": b"/api/statistics", "root_path": "", "scheme": "http",
+            "query_string": b"", "headers": [], "client": ("127.0.0.1", 1),
+            "server": ("testserver", 80), "http_version": "1.1",
+        }
+        messages = []
+
+        async def receive() -> dict:
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message: dict) -> None:
+            messages.append(message)
+
+        await app(scope, receive, send)
+        return messages[0]["status"]
+
+    async def run() -> list[int]:
+        app.state.release = asyncio.Event()
+        first = asyncio.create_task(request())
+        await asyncio.sleep(.01)
+        second = await request()
+        app.state.release.set()
+        return [await first, second]
+
+    assert asyncio.run(run()) == [200, 503]
+    assert limiter.metrics()["overloaded"] == 1
+    assert limiter.metrics()["in_flight"] == 0
@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+from starlette.requests import Request
+
+from app import database
+from app.replicas import Replica, ReplicaRouter
+
+MAX_LAG = 5.0
+
+
+def _request(headers: list[tuple[bytes, bytes]] = None) -> Request:
+    return Request({"type": "http", "headers": headers or []})
+
+
+@pytest.fixture()
+def replica_router() -> ReplicaRouter:
+    """Returns a router of two in-memory replicas."""
+    engines = [create_engine("sqlite://") for _ in range(2)]
+    router = ReplicaRouter(
+        engines, max_lag=MAX_LAG, check_interval=60, retry_interval=60
+    )
+    yield router
+    router.dispose()
+
+
+def test_replicas_round_robin(replica_router: ReplicaRouter) -> None:
+    """Testing that replicas are chosen in turn."""
+    engines = [replica.engine for replica in replica_router.replicas]
+    assert [replica_router.choose() for _ in range(4)] == engines * 2
+
+
+def test_failed_replica_is_skipped(replica_router: ReplicaRouter) -> None:
+    """Testing that a failed replica is not used and that reads go to
+    the primary when all replicas failed.
+    """
+    first, second = [replica.engine for replica in replica_router.replicas]
+    replica_router.mark_failed(first)
+    assert {replica_router.choose() for _ in range(4)} == {second}
+    replica_router.mark_failed(second)
+    assert replica_router.choose() is None
+
+
+def test_lagging_replica_is_skipped(
+    replica_router: ReplicaRouter, monkeypatch
+) -> None:
+    """Testing that a replica lagging more than the staleness bound is not used."""
+    lagging = replica_router.replicas[0]
+    monkeypatch.setattr(
+        Replica, "check_lag",
+        lambda replica: MAX_LAG * 2 if replica is lagging else .0
+    )
+    assert {replica_router.choose() for _ in range(4)} == {
+        replica_router.replicas[1].engine
+    }
+
+
+def test_lag_check_does_not_block_reads(
+    replica_router: ReplicaRouter, monkeypatch
+) -> None:
+    """Testing that while the lag of a replica is being checked, other threads
+    choose other replicas instead of waiting for the check.
+    """
+    slow, fast = replica_router.replicas
+    checking, release = threading.Event(), threading.Event()
+
+    def check_lag(replica: Replica) -> float:
+        if replica is slow:
+            checking.set()
+            release.wait(5)
+        return .0
+
+    monkeypatch.setattr(Replica, "check_lag", check_lag)
+    thread = threading.Thread(target=replica_router.choose)
+    thread.start()
+    checking.wait(5)
+    try:
+        assert {replica_router.choose() for _ in range(4)} == {fast.engine}
+    finally:
+        release.set()
+        thread.join()
+    assert replica_router.choose() in (slow.engine, fast.engine)
+
+
+@pytest.mark.parametrize(
+    "headers, from_replica",
+    [
+        ([], True),
+        ([(b"cookie", f"{database.READ_PRIMARY_COOKIE}=1".encode())], False),
+        ([(database.READ_PRIMARY_HEADER.lower().encode(), b"true")], False),
+    ]
+)
+def test_get_read_db_routing(
+    replica_router: ReplicaRouter, monkeypatch,
+    headers: list[tuple[bytes, bytes]], from_replica: bool
+) -> None:
+    """Testing that reads go to a replica unless the client reads its own writes."""
+    primary = create_engine("sqlite://")
+    monkeypatch.setattr(database, "replicas", replica_router)
+    database.use_engine(primary)
+    try:
+        sessions = database.get_read_db(_request(headers))
+        db = next(sessions)
+        replica_engines = [replica.engine for replica in replica_router.replicas]
+        assert (db.get_bind() in replica_engines) is from_replica
+        sessions.close()
+    finally:
+        monkeypatch.setattr(database, "engine", None)
+        primary.dispose()
@@ -0,0 +1,101 @@
+import time
+import tracemalloc
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app import models
+from app.crud import delete_all_statistics
+from app.main import app
+
+pytestmark = pytest.mark.scale
+
+client = TestClient(app)
+
+# Budgets for 10 years of statistics, scaled with '--scale-years'
+BUDGET_YEARS = 10
+
+
+@pytest.fixture()
+def within_budget(request):
+    """Returns a function that calls 'function' and fails the test if the call
+    takes more than 'seconds' or allocates more than 'megabytes' at peak.
+    Memory is measured with tracemalloc in a separate call, so that tracing
+    does not slow down the timed call. Budgets for 10 years of statistics
+    are scaled linearly with '--scale-years'.
+    """
+    scale = max(request.config.getoption("--scale-years") / BUDGET_YEARS, 1)
+
+    def call(function, seconds: float, megabytes: float = None):
+        started = time.perf_counter()
+        result = function()
+        assert time.perf_counter() - started < seconds * scale
+
+        if megabytes is not None:
+            tracemalloc.start()
+            try:
+                function()
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            assert peak / 1024 / 1024 < megabytes * scale
+        return result
+
+    return call
+
+
+def _days(db: Session) -> int:
+    return db.query(models.Statistics).count()
+
+
+def test_generated_statistics(generated_db: Session) -> None:
+    """Testing that the generated statistics have days without clicks and views."""
+    assert generated_db.query(models.Statistics).filter(
+        models.Statistics.views == 0
+    ).count()
+    assert generated_db.query(models.Statistics).filter(
+        models.Statistics.views > 0, models.Statistics.clicks == 0
+    ).count()
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/api/statistics",
+        "/api/statistics?sort_by=cpc&reverse_sort=true",
+        "/api/statistics?format=columnar",
+    ],
+)
+def test_get_statistics_scale(
+    generated_db: Session, within_budget, url: str
+) -> None:
+    """Testing reading all statistics within the budget."""
+    days = _days(generated_db)
+    response = within_budget(lambda: client.get(url), seconds=2, megabytes=40)
+    assert response.status_code == 200
+    statistics = response.json()
+    assert len(statistics["date"] if "columnar" in url else statistics) == days
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/api/statistics/top?sort_by=cpm&limit=100",
+        "/api/statistics/percentiles?percentiles=0.5&percentiles=0.99",
+        "/api/statistics/running?windows=7&windows=30",
+        "/api/statistics/total?date_from=2001-01-01",
+    ],
+)
+def test_aggregation_scale(generated_db: Session, within_budget, url: str) -> None:
+    """Testing aggregations over all statistics within the budget."""
+    response = within_budget(lambda: client.get(url), seconds=3, megabytes=40)
+    assert response.status_code == 200
+
+
+def test_delete_statistics_scale(generated_db: Session, within_budget) -> None:
+    """Testing deleting all statistics within the budget (the deletion is done
+    in bulk, so the memory does not depend on the number of statistics).
+    """
+    within_budget(lambda: delete_all_statistics(generated_db), seconds=1)
+    assert _days(generated_db) == 0
@@ -4,7 +4,10 @@ import pytest
 from sqlalchemy.orm import Session
 
 from app import models, schemas
-from app.services import _get_cpc, _get_cpm, get_returns_statistics
+from app.services import (
+    _get_cpc, _get_cpm, get_returns_percentiles, get_returns_statistics,
+    percentile_cont
+)
 
 STATISTICS_LIST_LEN = 3
 VIEWS_COUNT = 100
@@ -115,3 +118,39 @@ def test_returns_statistics_reversed_without_filter(get_statistics_list) -> None
     firs_key = list(return_statistics.keys())[0]
     assert firs_key == datetime.date(2000, 1, 1 * STATISTICS_LIST_LEN)
     assert return_statistics[firs_key]["cost"] == COSTS_VALUE * STATISTICS_LIST_LEN
+
+
+@pytest.mark.parametrize("reverse_sort", [False, True])
+def test_returns_statistics_filter_cpc_not_defined(reverse_sort: bool) -> None:
+    """Testing that days without clicks are placed last when sorting by cpc."""
+    statistics = [
+        models.Statistics(date=datetime.date(2000, 1, 1), views=10, clicks=0, cost=0),
+        models.Statistics(date=datetime.date(2000, 1, 2), views=10, clicks=1, cost=1),
+        models.Statistics(date=datetime.date(2000, 1, 3), views=10, clicks=1, cost=2),
+    ]
+    return_statistics = get_returns_statistics(statistics, "cpc", reverse_sort)
+    assert [statistics["cpc"] for statistics in return_statistics.values()] == \
+        ([2.0, 1.0] if reverse_sort else [1.0, 2.0]) + [None]
+
+
+@pytest.mark.parametrize(
+    "values, percentile, result",
+    [
+        ([], .5, None),
+        ([1], .9, 1),
+        ([1, 2, 3, 4], .5, 2.5),
+        ([1, 2, 3, 4], 0, 1),
+        ([1, 2, 3, 4], 1, 4),
+        ([0, 10], .25, 2.5),
+    ]
+)
+def test_percentile_cont(values: list[float], percentile: float, result) -> None:
+    """Testing the percentile with linear interpolation."""
+    assert percentile_cont(values, percentile) == result
+
+
+def test_returns_percentiles() -> None:
+    """Testing the output form of percentiles."""
+    assert get_returns_percentiles(
+        [.5, .9], {"cost": [1.005, None]}
+    ) == {"cost": {"0.5": round(1.005, 2), "0.9": None}}
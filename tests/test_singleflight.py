@@ -0,0 +1,132 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app import database, router
+from app.database import Base
+from app.exceptions import CoalescedFailureException
+from app.main import create_app
+from app.singleflight import SingleFlight, statistics_reads
+
+CALLERS = 8
+
+
+def _run_concurrently(flight: SingleFlight, key, function) -> list:
+    """Calls the function through the flight from several threads at once.
+    Returns the results (or exceptions) of all calls.
+    """
+    with ThreadPoolExecutor(CALLERS) as executor:
+        futures = [
+            executor.submit(flight.do, key, function) for _ in range(CALLERS)
+        ]
+        return [future.exception() or future.result() for future in futures]
+
+
+def test_concurrent_calls_share_result() -> None:
+    """Testing that concurrent calls with the same key run the function once."""
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def compute() -> bytes:
+        calls.append(1)
+        release.wait(5)
+        return b"{}"
+
+    def release_when_coalesced() -> None:
+        while flight.coalesced < CALLERS - 1:
+            threading.Event().wait(.01)
+        release.set()
+
+    threading.Thread(target=release_when_coalesced, daemon=True).start()
+    results = _run_concurrently(flight, "key", compute)
+
+    assert results == [b"{}"] * CALLERS
+    assert len(calls) == 1
+    assert flight.metrics() == {
+        "in_flight": 0, "executions": 1, "coalesced": CALLERS - 1
+    }
+
+
+def test_concurrent_calls_share_exception() -> None:
+    """Testing that the exception of the computation is raised in the caller
+    that ran it and waiting callers receive CoalescedFailureException caused by it.
+    """
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def compute() -> bytes:
+        release.wait(5)
+        raise ValueError("failed")
+
+    def release_when_coalesced() -> None:
+        while flight.coalesced < CALLERS - 1:
+            threading.Event().wait(.01)
+        release.set()
+
+    threading.Thread(target=release_when_coalesced, daemon=True).start()
+    results = _run_concurrently(flight, "key", compute)
+
+    assert sorted(type(result).__name__ for result in results) == \
+        ["CoalescedFailureException"] * (CALLERS - 1) + ["ValueError"]
+    assert all(
+        isinstance(result.__cause__, ValueError) for result in results
+        if isinstance(result, CoalescedFailureException)
+    )
+    assert flight.executions == 1
+
+
+def test_finished_call_is_not_cached() -> None:
+    """Testing that calls after the computation has finished run it again
+    and that different keys are not coalesced.
+    """
+    flight = SingleFlight()
+    results = iter(range(3))
+    assert flight.do("key", lambda: next(results)) == 0
+    assert flight.do("key", lambda: next(results)) == 1
+    assert flight.do("other", lambda: next(results)) == 2
+    assert flight.metrics() == {"in_flight": 0, "executions": 3, "coalesced": 0}
+
+    with pytest.raises(ZeroDivisionError):
+        flight.do("key", lambda: 1 / 0)
+    assert flight.do("key", lambda: "recomputed") == "recomputed"
+
+
+def test_coalesced_failure_is_counted_once(tmp_path, monkeypatch) -> None:
+    """Testing that a failed read shared by concurrent requests is counted
+    by the circuit breaker once instead of once per request.
+    """
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    release = threading.Event()
+
+    def read_statistics(*args) -> list:
+        release.wait(5)
+        raise PoolTimeoutError("The pool is exhausted")
+
+    def release_when_coalesced() -> None:
+        while statistics_reads.coalesced < coalesced + CALLERS - 1:
+            threading.Event().wait(.01)
+        release.set()
+
+    monkeypatch.setattr(router, "get_statistics_for_date_period", read_statistics)
+    try:
+        with TestClient(
+            create_app(engine=engine), raise_server_exceptions=False
+        ) as client:
+            coalesced = statistics_reads.coalesced
+            threading.Thread(target=release_when_coalesced, daemon=True).start()
+            with ThreadPoolExecutor(CALLERS) as executor:
+                responses = list(executor.map(
+                    lambda _: client.get("/api/statistics"), range(CALLERS)
+                ))
+            assert {response.status_code for response in responses} == {500}
+            assert database.breaker.failures == 1
+    finally:
+        database.dispose_engine()